@@ -4,59 +4,86 @@ Comprehensive REST API server for controlling LED lights with full pattern suppo
 Provides endpoints for all light patterns, controls, and system management.
 """
 
-from flask import Flask, jsonify, request
-from flask_cors import CORS
-import argparse
+from flask import Flask, Response, jsonify, request
 import atexit
 import os
-from light_service import get_light_service
-from state_manager import StateManager, AutoStateManager
-from presets import PresetManager
+import threading
+from state_manager import AutoStateManager
+from profiler import MODES
+from fast_start import build_parser, start_lights
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for web client access
 
 # Global instances
 light_service = None
 state_manager = None
 auto_state_manager = None
 preset_manager = None
+fake_spi_factory = None  # Set when running against recording fake SPI devices
+presets_dir = None  # Where the preset manager keeps presets once created
+_preset_lock = threading.Lock()
 
 
-def initialize_services(use_lights=True, n_pixels=50, show_animation=False):
+def initialize_services(use_lights=True, n_pixels=50, show_animation=False, target_fps=60,
+                        loop_cache_mb=0, pipelined=False, strip_configs=None, fake_spi_hz=None,
+                        state_dir=None, state_journal=False):
     """Initialize all services"""
-    global light_service, state_manager, auto_state_manager, preset_manager
-    
-    # Initialize light service
-    light_service = get_light_service(use_lights=use_lights, n_pixels=n_pixels, show_animation=show_animation)
-    if not light_service.initialize():
-        raise RuntimeError("Failed to initialize light service")
+    services = start_lights(use_lights=use_lights, n_pixels=n_pixels,
+                            show_animation=show_animation, target_fps=target_fps,
+                            loop_cache_mb=loop_cache_mb, pipelined=pipelined,
+                            strip_configs=strip_configs, fake_spi_hz=fake_spi_hz,
+                            state_dir=state_dir, state_journal=state_journal)
+    use_services(*services, state_dir=state_dir)
+
+
+def use_services(service, manager, spi_factory=None, state_dir=None):
+    """Serve an already running light service and finish starting up around it"""
+    global light_service, state_manager, auto_state_manager, fake_spi_factory, presets_dir
     
-    # Initialize state management
-    state_manager = StateManager()
+    light_service = service
+    state_manager = manager
+    fake_spi_factory = spi_factory
+    presets_dir = os.path.join(state_dir, 'presets') if state_dir else None
     
-    # Try to restore previous state
-    if state_manager.state_exists():
-        result = state_manager.apply_state_to_service(light_service)
-        print(f"State restoration: {result.get('message', 'Unknown result')}")
+    # Enable CORS for web client access
+    from flask_cors import CORS
+    CORS(app)
     
     # Start automatic state saving
     auto_state_manager = AutoStateManager(light_service, state_manager)
     auto_state_manager.start()
     
-    # Initialize preset management
-    preset_manager = PresetManager()
+    # Register shutdown handler. atexit runs handlers last in, first out,
+    # so registering after the light service's own handler means the final
+    # state is saved before the lights are shut down
+    atexit.register(shutdown_services)
     
     print("Light API services initialized successfully")
 
 
+def get_preset_manager():
+    """Preset manager, created on first use since it writes the default
+    presets. None until the light service is up"""
+    global preset_manager
+    
+    if light_service is None:
+        return None
+    with _preset_lock:
+        if preset_manager is None:
+            from presets import PresetManager
+            preset_manager = PresetManager(presets_dir)
+        return preset_manager
+
+
 def shutdown_services():
     """Shutdown all services"""
     global auto_state_manager, light_service
     
     if auto_state_manager:
-        auto_state_manager.force_save()  # Save final state
+        # Stop the saver first so the final save can't race a debounced one,
+        # and save while the light service is still running
         auto_state_manager.stop()
+        auto_state_manager.force_save()  # Save final state
     
     if light_service:
         light_service.shutdown()
@@ -64,9 +91,6 @@ def shutdown_services():
     print("Light API services shut down")
 
 
-# Register shutdown handler
-atexit.register(shutdown_services)
-
 
 # Error handlers
 @app.errorhandler(404)
@@ -107,6 +131,10 @@ def get_info():
             'mute': '/api/mute',
             'sync': '/api/sync',
             'status': '/api/status',
+            'stats': '/api/stats',
+            'metrics': '/api/metrics',
+            'profile': '/api/debug/profile',
+            'fake_spi': '/api/debug/spi',
             'presets': '/api/presets'
         }
     })
@@ -122,6 +150,68 @@ def get_status():
     return jsonify({'success': True, 'status': status})
 
 
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Get render loop frame rate, jitter and output stats"""
+    if not light_service:
+        return jsonify({'success': False, 'message': 'Service not initialized'}), 500
+    
+    result = light_service.get_frame_stats()
+    if state_manager:
+        result['state'] = state_manager.get_stats()
+    status_code = 200 if result['success'] else 500
+    return jsonify(result), status_code
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Get render loop stage timings and counters for Prometheus"""
+    metrics = light_service.get_metrics() if light_service else None
+    if metrics is None:
+        return Response('# Service not initialized\n', status=500, mimetype='text/plain')
+    
+    return Response(metrics, mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/debug/spi', methods=['GET'])
+def fake_spi_stats():
+    """Get what the fake SPI devices have recorded (--fake-spi only)"""
+    if fake_spi_factory is None:
+        return jsonify({'success': False, 'message': 'Not running with --fake-spi'}), 404
+    
+    devices = []
+    for spi in fake_spi_factory.devices:
+        stats = spi.get_stats()
+        last = spi.last_frame()
+        stats['last_frame'] = last.hex() if last is not None else None
+        devices.append(stats)
+    return jsonify({'success': True, 'devices': devices})
+
+
+@app.route('/api/debug/profile', methods=['GET'])
+def profile_render_loop():
+    """Profile the render thread, e.g. /api/debug/profile?seconds=10&mode=sample"""
+    if not light_service:
+        return jsonify({'success': False, 'message': 'Service not initialized'}), 500
+    
+    try:
+        seconds = float(request.args.get('seconds', 5))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid seconds value'}), 400
+    
+    mode = request.args.get('mode', 'cprofile')
+    if mode not in MODES:
+        return jsonify({'success': False, 'message': f'Invalid profile mode: {mode}',
+                        'available_modes': list(MODES)}), 400
+    
+    result = light_service.profile(seconds, mode)
+    if not result['success']:
+        # Loop not running or another profile in progress
+        return jsonify(result), 409
+    
+    return Response(result['report'], mimetype='text/plain')
+
+
 # Pattern control endpoints
 @app.route('/api/patterns', methods=['GET'])
 def get_patterns():
@@ -207,7 +297,8 @@ def saturation_control():
         return jsonify({'success': False, 'message': 'saturation value required'}), 400
     
     try:
-        result = light_service.set_saturation(float(saturation))
+        transition = float(data.get('transition', 0.0))
+        result = light_service.set_saturation(float(saturation), transition=transition)
         return jsonify(result)
     except (ValueError, TypeError):
         return jsonify({'success': False, 'message': 'Invalid saturation value'}), 400
@@ -235,7 +326,8 @@ def hue_control():
         return jsonify({'success': False, 'message': 'hue value required'}), 400
     
     try:
-        result = light_service.set_hue(float(hue))
+        transition = float(data.get('transition', 0.0))
+        result = light_service.set_hue(float(hue), transition=transition)
         return jsonify(result)
     except (ValueError, TypeError):
         return jsonify({'success': False, 'message': 'Invalid hue value'}), 400
@@ -262,7 +354,8 @@ def speed_control():
         return jsonify({'success': False, 'message': 'speed value required'}), 400
     
     try:
-        result = light_service.set_speed(float(speed))
+        transition = float(data.get('transition', 0.0))
+        result = light_service.set_speed(float(speed), transition=transition)
         return jsonify(result)
     except (ValueError, TypeError):
         return jsonify({'success': False, 'message': 'Invalid speed value'}), 400
@@ -289,7 +382,8 @@ def tempo_control():
         return jsonify({'success': False, 'message': 'tempo value required'}), 400
     
     try:
-        result = light_service.set_tempo(int(tempo))
+        transition = float(data.get('transition', 0.0))
+        result = light_service.set_tempo(int(tempo), transition=transition)
         return jsonify(result)
     except (ValueError, TypeError):
         return jsonify({'success': False, 'message': 'Invalid tempo value'}), 400
@@ -396,17 +490,27 @@ def reset_to_default():
 # Preset management endpoints
 @app.route('/api/presets', methods=['GET'])
 def list_presets():
-    """Get all available presets"""
+    """Get available presets, optionally paged with offset and limit
+    and filtered by pattern"""
+    preset_manager = get_preset_manager()
     if not preset_manager:
         return jsonify({'success': False, 'message': 'Preset manager not initialized'}), 500
     
-    result = preset_manager.list_presets()
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = request.args.get('limit')
+        limit = max(0, int(limit)) if limit is not None else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'offset and limit must be integers'}), 400
+    
+    result = preset_manager.list_presets(offset, limit, request.args.get('pattern'))
     return jsonify(result)
 
 
 @app.route('/api/presets', methods=['POST'])
 def create_preset():
     """Create a new preset from current state"""
+    preset_manager = get_preset_manager()
     if not light_service or not preset_manager:
         return jsonify({'success': False, 'message': 'Services not initialized'}), 500
     
@@ -430,6 +534,7 @@ def create_preset():
 @app.route('/api/presets/<preset_id>', methods=['GET'])
 def get_preset(preset_id):
     """Get a specific preset"""
+    preset_manager = get_preset_manager()
     if not preset_manager:
         return jsonify({'success': False, 'message': 'Preset manager not initialized'}), 500
     
@@ -441,6 +546,7 @@ def get_preset(preset_id):
 @app.route('/api/presets/<preset_id>', methods=['POST'])
 def apply_preset(preset_id):
     """Apply a preset to the lights"""
+    preset_manager = get_preset_manager()
     if not light_service or not preset_manager:
         return jsonify({'success': False, 'message': 'Services not initialized'}), 500
     
@@ -457,6 +563,7 @@ def apply_preset(preset_id):
 @app.route('/api/presets/<preset_id>', methods=['PUT'])
 def update_preset(preset_id):
     """Update an existing preset"""
+    preset_manager = get_preset_manager()
     if not preset_manager:
         return jsonify({'success': False, 'message': 'Preset manager not initialized'}), 500
     
@@ -476,6 +583,7 @@ def update_preset(preset_id):
 @app.route('/api/presets/<preset_id>', methods=['DELETE'])
 def delete_preset(preset_id):
     """Delete a preset"""
+    preset_manager = get_preset_manager()
     if not preset_manager:
         return jsonify({'success': False, 'message': 'Preset manager not initialized'}), 500
     
@@ -681,76 +789,81 @@ def sleep_mode():
     })
 
 
+def serve(args):
+    """Print the startup banner and run the server until it exits"""
+    print(f"Starting Light API Server...")
+    mode_str = 'Simulation'
+    if not args.no_lights:
+        mode_str = 'Hardware' if args.fake_spi is None else 'Hardware (recording fake SPI)'
+    elif args.show_animation:
+        mode_str = 'Simulation with Animation'
+    else:
+        mode_str = 'Simulation (Headless)'
+    
+    print(f"Mode: {mode_str}")
+    print(f"Pixels: {args.pixels}")
+    print(f"Target FPS: {args.fps:g}")
+    print(f"Server: http://{args.host}:{args.port}")
+    
+    if args.show_animation:
+        print("🎨 Pygame window will show light patterns")
+    print("📡 REST API ready for control")
+    print("Available endpoints:")
+    print("  GET  /api/health       - Health check")
+    print("  GET  /api/info         - API information") 
+    print("  GET  /api/status       - Current status")
+    print("  GET  /api/stats        - Frame rate and jitter")
+    print("  GET  /api/metrics      - Stage timings (Prometheus)")
+    print("  GET  /api/debug/profile - Profile the render loop")
+    if args.fake_spi is not None:
+        print("  GET  /api/debug/spi     - Bytes recorded by the fake SPI")
+    print("  GET  /api/patterns     - Available patterns")
+    print("  POST /api/patterns/<name> - Set pattern")
+    print("  GET/POST /api/brightness  - Control brightness")
+    print("  GET/POST /api/saturation  - Control saturation")
+    print("  GET/POST /api/speed       - Control speed")
+    print("  GET/POST /api/tempo       - Control tempo")
+    print("  GET/POST /api/alt-mode    - Control alt mode")
+    print("  GET/POST/DELETE /api/mute - Control mute")
+    print("  POST /api/sync            - Sync phase")
+    print("  POST /api/lights/on       - Turn lights on")
+    print("  POST /api/lights/off      - Turn lights off")
+    print("  POST /api/party-mode      - Party mode")
+    print("  POST /api/ambient-mode    - Ambient mode")
+    print("  POST /api/reading-mode    - Reading mode")
+    print("  POST /api/movie-mode      - Movie mode")
+    print("  POST /api/energize-mode   - Energize mode")
+    print("  POST /api/sleep-mode      - Sleep mode")
+    print("  GET  /api/presets         - List all presets")
+    print("  POST /api/presets         - Create new preset")
+    print("  GET  /api/presets/<id>    - Get specific preset")
+    print("  POST /api/presets/<id>    - Apply preset")
+    print("  PUT  /api/presets/<id>    - Update preset")
+    print("  DELETE /api/presets/<id>  - Delete preset")
+    print("")
+    
+    # Run the Flask server
+    app.run(host=args.host, port=args.port, debug=args.debug, threaded=True)
+
+
 if __name__ == '__main__':
     # Parse command line arguments
-    parser = argparse.ArgumentParser(description='All of the Lights API Server')
-    parser.add_argument('--no-lights', action='store_true', 
-                       help='Run in simulation mode without actual lights')
-    parser.add_argument('--show-animation', action='store_true',
-                       help='Show pygame animation window (works with --no-lights)')
-    parser.add_argument('--pixels', type=int, default=50,
-                       help='Number of pixels in simulation mode')
-    parser.add_argument('--host', default='0.0.0.0',
-                       help='Host to bind to')
-    parser.add_argument('--port', type=int, default=5000,
-                       help='Port to bind to')
-    parser.add_argument('--debug', action='store_true',
-                       help='Run in debug mode')
-    
-    args = parser.parse_args()
+    args = build_parser().parse_args()
     
     # Initialize services
     try:
-        initialize_services(use_lights=not args.no_lights, n_pixels=args.pixels, show_animation=args.show_animation)
-        
-        print(f"Starting Light API Server...")
-        mode_str = 'Simulation'
-        if not args.no_lights:
-            mode_str = 'Hardware'
-        elif args.show_animation:
-            mode_str = 'Simulation with Animation'
-        else:
-            mode_str = 'Simulation (Headless)'
-        
-        print(f"Mode: {mode_str}")
-        print(f"Pixels: {args.pixels}")
-        print(f"Server: http://{args.host}:{args.port}")
-        
-        if args.show_animation:
-            print("🎨 Pygame window will show light patterns")
-        print("📡 REST API ready for control")
-        print("Available endpoints:")
-        print("  GET  /api/health       - Health check")
-        print("  GET  /api/info         - API information") 
-        print("  GET  /api/status       - Current status")
-        print("  GET  /api/patterns     - Available patterns")
-        print("  POST /api/patterns/<name> - Set pattern")
-        print("  GET/POST /api/brightness  - Control brightness")
-        print("  GET/POST /api/saturation  - Control saturation")
-        print("  GET/POST /api/speed       - Control speed")
-        print("  GET/POST /api/tempo       - Control tempo")
-        print("  GET/POST /api/alt-mode    - Control alt mode")
-        print("  GET/POST/DELETE /api/mute - Control mute")
-        print("  POST /api/sync            - Sync phase")
-        print("  POST /api/lights/on       - Turn lights on")
-        print("  POST /api/lights/off      - Turn lights off")
-        print("  POST /api/party-mode      - Party mode")
-        print("  POST /api/ambient-mode    - Ambient mode")
-        print("  POST /api/reading-mode    - Reading mode")
-        print("  POST /api/movie-mode      - Movie mode")
-        print("  POST /api/energize-mode   - Energize mode")
-        print("  POST /api/sleep-mode      - Sleep mode")
-        print("  GET  /api/presets         - List all presets")
-        print("  POST /api/presets         - Create new preset")
-        print("  GET  /api/presets/<id>    - Get specific preset")
-        print("  POST /api/presets/<id>    - Apply preset")
-        print("  PUT  /api/presets/<id>    - Update preset")
-        print("  DELETE /api/presets/<id>  - Delete preset")
-        print("")
-        
-        # Run the Flask server
-        app.run(host=args.host, port=args.port, debug=args.debug, threaded=True)
+        strip_configs = None
+        if args.strips:
+            from strips import load_strip_config
+            strip_configs = load_strip_config(args.strips)
+
+        initialize_services(use_lights=not args.no_lights, n_pixels=args.pixels,
+                            show_animation=args.show_animation, target_fps=args.fps,
+                            loop_cache_mb=args.loop_cache_mb, pipelined=args.pipelined,
+                            strip_configs=strip_configs, fake_spi_hz=args.fake_spi,
+                            state_dir=args.state_dir, state_journal=args.state_journal)
+        serve(args)
         
     except Exception as e:
         print(f"Failed to start server: {e}")
-        exit(1)
\ No newline at end of file
+        exit(1)
@@ -0,0 +1,519 @@
+""" Benchmarks for the light pipeline. Runs without any
+hardware attached by swapping the SPI device for a
+fake_spi.RecordingSpi that discards, or times, what it is sent """
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+import time
+import urllib.request
+import numpy as np
+from fake_spi import RecordingSpi
+
+
+def time_per_call(fn, repeats):
+    """ Returns the mean seconds per call of fn over repeats calls """
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def bench_output(pixel_counts, repeats):
+    """ Compares the per pixel set_all_values loop with show_frame """
+    import Adafruit_WS2801
+    import pixels as px
+
+    # Latch delay is the same for both paths and would swamp the numbers
+    px.LATCH_DELAY = 0
+
+    print(f"{'pixels':>8} {'loop (ms)':>12} {'bulk (ms)':>12} {'speedup':>9}")
+    for n_pix in pixel_counts:
+        strip = Adafruit_WS2801.WS2801Pixels(n_pix, spi=RecordingSpi(max_records=0))
+        frame = np.random.uniform(0, 255, (n_pix, 3))
+        out = np.empty((n_pix, 3), dtype=np.uint8)
+
+        def loop():
+            px.set_all_values(strip, frame)
+            strip._spi.write(strip._pixels)
+
+        def bulk():
+            px.show_frame(strip, frame, out=out)
+
+        loop_time = time_per_call(loop, repeats)
+        bulk_time = time_per_call(bulk, repeats)
+        print(f"{n_pix:>8} {loop_time * 1000:>12.3f} {bulk_time * 1000:>12.3f} "
+              f"{loop_time / bulk_time:>8.1f}x")
+
+
+def bench_sparks(pixel_counts, repeats):
+    """ Per frame cost of sparks. Each call gets a fresh cache so
+    every frame lights new sparks rather than sitting in its wait """
+    from constants import CANDLE
+    from patterns import sparks
+
+    print(f"{'pixels':>8} {'frame (ms)':>12}")
+    for n_pix in pixel_counts:
+        kwargs = {"shape": (n_pix, 3),
+                  "n_cycles": 0,
+                  "saturation": 0.8,
+                  "hue": 30,
+                  "warm_rgb": CANDLE,
+                  "warm_shift": True,
+                  "alt": False,
+                  "loop_start": 0.}
+        frame_time = time_per_call(lambda: sparks(0., {}, kwargs), repeats)
+        print(f"{n_pix:>8} {frame_time * 1000:>12.3f}")
+
+
+def bench_contention(n_clients, duration, n_pixels):
+    """ Render loop jitter while n_clients hammer /api/brightness
+    through the real Flask app, compared with an idle API """
+    from werkzeug.serving import make_server
+    import api_server
+    from light_service import get_light_service
+
+    service = get_light_service(use_lights=False, n_pixels=n_pixels)
+    service.initialize()
+    service.set_pattern('pulse')
+    api_server.light_service = service
+    controller = service.controller
+
+    server = make_server('127.0.0.1', 0, api_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/api/brightness"
+
+    def measure():
+        # Jitter comes from the scheduler's recent window, which at the
+        # default 2 s and 60 fps covers just the measured interval
+        frames = controller.frame_number
+        dropped = controller.get_frame_stats()['frames_dropped']
+        time.sleep(duration)
+        stats = controller.get_frame_stats()
+        stats['achieved_fps'] = (controller.frame_number - frames) / duration
+        stats['frames_dropped'] -= dropped
+        return stats
+
+    stop = threading.Event()
+    requests_done = [0] * n_clients
+
+    def client(i):
+        while not stop.is_set():
+            body = json.dumps({'brightness': (i % 10) / 10, 'transition': 0}).encode()
+            req = urllib.request.Request(url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(req) as resp:
+                resp.read()
+            requests_done[i] += 1
+
+    idle = measure()
+    clients = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(n_clients)]
+    for t in clients:
+        t.start()
+    loaded = measure()
+    stop.set()
+    for t in clients:
+        t.join()
+    server.shutdown()
+    service.shutdown()
+
+    print(f"{'':>8} {'fps':>8} {'jitter (ms)':>12} {'dropped':>8}")
+    for name, stats in [('idle', idle), ('loaded', loaded)]:
+        print(f"{name:>8} {stats['achieved_fps']:>8.2f} {stats['jitter_ms']:>12.3f} "
+              f"{stats['frames_dropped']:>8}")
+    print(f"{n_clients} clients, {sum(requests_done) / duration:.0f} requests/s")
+
+
+def stage_totals(metrics_text):
+    """ (sum seconds, count) per stage from the Prometheus text of
+    HeadlessController.get_metrics() """
+    totals = {}
+    for line in metrics_text.splitlines():
+        for suffix, index in (('_sum', 0), ('_count', 1)):
+            prefix = f'lights_stage_seconds{suffix}{{stage="'
+            if line.startswith(prefix):
+                stage, value = line[len(prefix):].split('"} ')
+                totals.setdefault(stage, [0.0, 0])[index] = float(value)
+    return totals
+
+
+def bench_metrics(pixel_counts, seconds, repeats):
+    """ Cost of the per stage timing in the render loop, relative
+    to the work it measures and to the frame period """
+    from headless_controller import HeadlessController
+    from metrics import FrameMetrics
+
+    # What the loop adds per frame: a clock read and an observe per stage
+    metrics = FrameMetrics()
+    perf_counter = time.perf_counter
+
+    def instrumentation():
+        stage_start = perf_counter()
+        for stage in ('render', 'dimming', 'output', 'show'):
+            stage_end = perf_counter()
+            metrics.observe(stage, stage_end - stage_start)
+            stage_start = stage_end
+
+    overhead = time_per_call(instrumentation, repeats)
+
+    print(f"instrumentation: {overhead * 1e6:.2f} us per frame")
+    print(f"{'pixels':>8} {'work (ms)':>10} {'of work':>9} {'of frame':>9}")
+    for n_pix in pixel_counts:
+        controller = HeadlessController(use_lights=False, n_pixels=n_pix)
+        controller.start()
+        time.sleep(seconds)
+        controller.stop()
+
+        stages = stage_totals(controller.get_metrics())
+        frames = stages['render'][1]
+        work = sum(total for total, _ in stages.values()) / frames
+        period = 1.0 / controller.get_frame_stats()['target_fps']
+        print(f"{n_pix:>8} {work * 1000:>10.3f} {overhead / work:>8.2%} {overhead / period:>8.3%}")
+
+
+def case_renderer(function, n_pix, alt, warm_shift, fps=60):
+    """ Returns render(i), which renders frame i of one pattern with
+    HeadlessController.render_frame on a virtual clock, with no sleeping
+    and a null sink for the output """
+    from frames import output_buffer
+    from headless_controller import HeadlessController
+
+    controller = HeadlessController(use_lights=False, n_pixels=n_pix, clock=lambda: 0.)
+    controller.commit({'function': function, 'alt': alt, 'warm_shift': warm_shift,
+                       'saturation': 0.8, 'hue': 30, 'brightness': 0.8})
+    sink = RecordingSpi(max_records=0)
+    frame = output_buffer(controller.shape)
+
+    def render(i):
+        sink.write(controller.render_frame(i / fps, out=frame))
+
+    return render
+
+
+def bench_suite(pixel_counts, frames, output=None, baseline=None, threshold=0.2):
+    """ Every pattern, in both alt modes, with and without warm shift,
+    at each pixel count. Writes results as JSON if output is given and
+    returns False if any case is slower than baseline by more than
+    threshold (as a fraction of the baseline fps) """
+    from constants import PATTERN_FN_NAMES
+
+    results = {}
+    print(f"{'case':<40} {'fps':>10} {'p50 (ms)':>9} {'p99 (ms)':>9} {'alloc (KB)':>11}")
+    for function, name in PATTERN_FN_NAMES.items():
+        for alt in (False, True):
+            for warm_shift in (False, True):
+                for n_pix in pixel_counts:
+                    case = f"{name}/alt={alt:d}/warm={warm_shift:d}/{n_pix}"
+                    render = case_renderer(function, n_pix, alt, warm_shift)
+                    times = []
+                    for i in range(frames):
+                        start = time.perf_counter()
+                        render(i)
+                        times.append(time.perf_counter() - start)
+                    times.sort()
+
+                    # Separate pass for memory so tracing doesn't skew the timings.
+                    # Peak traced memory above what is held afterwards is what
+                    # the frame allocated and threw away
+                    tracemalloc.start()
+                    render(frames)
+                    tracemalloc.reset_peak()
+                    base_current, _ = tracemalloc.get_traced_memory()
+                    render(frames + 1)
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+
+                    results[case] = {
+                        'fps': len(times) / sum(times),
+                        'p50_ms': times[len(times) // 2] * 1000,
+                        'p99_ms': times[min(len(times) - 1, int(len(times) * 0.99))] * 1000,
+                        'alloc_kb': (peak - base_current) / 1024
+                    }
+                    r = results[case]
+                    print(f"{case:<40} {r['fps']:>10.0f} {r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f} "
+                          f"{r['alloc_kb']:>11.1f}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'frames': frames, 'results': results}, f, indent=2)
+
+    if baseline is None:
+        return True
+
+    with open(baseline) as f:
+        base = json.load(f)['results']
+    regressions = []
+    for case, r in results.items():
+        if case in base and r['fps'] < base[case]['fps'] * (1 - threshold):
+            regressions.append(case)
+            print(f"REGRESSION {case}: {r['fps']:.0f} fps vs {base[case]['fps']:.0f} baseline")
+    print(f"{len(regressions)} of {len(results)} cases regressed beyond {threshold:.0%}")
+    return not regressions
+
+
+def bench_pipeline(n_pix, spi_hz, seconds):
+    """ Achieved frame rate with rendering and output in series and
+    pipelined, against an SPI device that takes real transfer time """
+    import Adafruit_WS2801
+    from headless_controller import HeadlessController
+
+    print(f"{n_pix} pixels, {n_pix * 3 * 8 / spi_hz * 1000:.2f} ms per transfer")
+    print(f"{'mode':>10} {'rendered/s':>11} {'shown/s':>8} {'render (ms)':>12} {'show (ms)':>10}")
+    for pipelined in (False, True):
+        strip = Adafruit_WS2801.WS2801Pixels(n_pix, spi=RecordingSpi(clock_hz=spi_hz, max_records=0))
+        controller = HeadlessController(n_pixels=n_pix, target_fps=240, pipelined=pipelined,
+                                        pixels=strip)
+        controller.start()
+        time.sleep(seconds)
+        frames = controller.frame_number
+        controller.stop()
+
+        stages = stage_totals(controller.get_metrics())
+        render = sum(stages[s][0] for s in ('render', 'dimming', 'output')) / stages['render'][1]
+        show = stages['show'][0] / max(1, stages['show'][1])
+        print(f"{'pipelined' if pipelined else 'serial':>10} {frames / seconds:>11.1f} "
+              f"{stages['show'][1] / seconds:>8.1f} {render * 1000:>12.2f} {show * 1000:>10.2f}")
+
+
+# Run in a fresh interpreter per measurement: imports what the entry point
+# needs before the first frame, starts up against fake SPI and reports
+# when the first frame was written, on the shared monotonic clock
+COLDSTART_CHILD = """
+import json, sys, time
+mode, n_pix, state_dir = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+start = time.perf_counter()
+if mode == 'standard':
+    import api_server
+else:
+    import fast_start, light_service, state_manager
+import_ms = (time.perf_counter() - start) * 1000
+if mode == 'standard':
+    api_server.initialize_services(n_pixels=n_pix, fake_spi_hz=0, state_dir=state_dir)
+    spi_factory = api_server.fake_spi_factory
+else:
+    services = fast_start.start_lights(n_pixels=n_pix, fake_spi_hz=0, state_dir=state_dir)
+    import api_server
+    api_server.use_services(*services, state_dir=state_dir)
+    spi_factory = services[2]
+ready = time.monotonic()
+print(json.dumps({'import_ms': import_ms, 'first_write': spi_factory.devices[0].records[0][0],
+                  'ready': ready}))
+"""
+
+
+def bench_coldstart(runs, n_pix):
+    """ Import time and time to first frame, from launching the
+    process, for the standard and fast start paths. Each run is a new
+    interpreter starting against fake SPI with a saved state to restore """
+    from state_manager import StateManager
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    print(f"{'path':>10} {'import (ms)':>12} {'first frame (ms)':>17} {'api ready (ms)':>15}")
+    with tempfile.TemporaryDirectory() as state_dir:
+        StateManager(state_dir).save_state({'pattern': 'pulse', 'brightness': 0.6, 'saturation': 0.4,
+                                            'hue': 30, 'tempo': 60, 'mute': False,
+                                            'mute_type': 'instant'})
+        for mode in ('standard', 'fast'):
+            results = []
+            for _ in range(runs):
+                launched = time.monotonic()
+                out = subprocess.run([sys.executable, '-c', COLDSTART_CHILD, mode, str(n_pix), state_dir],
+                                     cwd=here, capture_output=True, text=True, check=True).stdout
+                r = json.loads(next(line for line in reversed(out.splitlines())
+                                    if line.startswith('{')))
+                results.append((r['import_ms'], (r['first_write'] - launched) * 1000,
+                                (r['ready'] - launched) * 1000))
+            # Median of each column
+            medians = [sorted(column)[len(column) // 2] for column in zip(*results)]
+            print(f"{mode:>10} {medians[0]:>12.1f} {medians[1]:>17.1f} {medians[2]:>15.1f}")
+
+
+def verify_output(n_pix, frames):
+    """ Checks that what reaches the SPI device is byte for byte the
+    rendered frame in wire order, for every pattern, and the same bytes
+    the per pixel set_all_values + show() path sends. Also checks the
+    first frame the live loop writes. Returns False on any mismatch """
+    import Adafruit_WS2801
+    import pixels as px
+    from fake_spi import RecordingSpiFactory
+    from headless_controller import PATTERNS, HeadlessController
+
+    failures = []
+    for name in PATTERNS:
+        factory = RecordingSpiFactory()
+        controller = HeadlessController(pixels=px.get_pixels(n_pix, spi_factory=factory),
+                                        clock=lambda: 0.)
+        controller.restore({'pattern': name, 'brightness': 0.7, 'saturation': 0.6, 'hue': 200})
+        spi = factory.devices[0]
+        legacy_spi = RecordingSpi()
+        legacy = Adafruit_WS2801.WS2801Pixels(n_pix, spi=legacy_spi)
+        for i in range(frames):
+            frame = controller.render_frame(i / 60)
+            controller.show_frame(controller.pixels, frame)
+            px.set_all_values(legacy, frame)
+            legacy.show()
+            expected = px.frame_to_bytes(frame).tobytes()
+            if spi.last_frame() != expected or legacy_spi.last_frame() != expected:
+                failures.append(f"{name} frame {i}")
+                break
+
+    # Live loop: the first write should be the restored scene
+    factory = RecordingSpiFactory()
+    controller = HeadlessController(pixels=px.get_pixels(n_pix, spi_factory=factory))
+    controller.restore({'pattern': 'solid', 'brightness': 0.5, 'saturation': 1.0, 'hue': 120})
+    controller.start()
+    controller.wait_for_first_frame(timeout=1.0)
+    controller.stop()
+    first = factory.devices[0].records[0][1] if factory.devices[0].records else None
+    if first != px.frame_to_bytes(controller.render_frame(0.)).tobytes():
+        failures.append("live loop first frame")
+
+    for failure in failures:
+        print(f"MISMATCH {failure}")
+    print(f"output: {len(PATTERNS)} patterns x {frames} frames + live loop, "
+          f"{len(failures)} mismatches")
+    return not failures
+
+
+def verify_strips(frames):
+    """ Checks that each strip of a MultiStrip receives exactly its
+    offset/length slice of the frame in its channel order, including
+    non-uint8 frames from the controller, and is blanked by turn_off.
+    Returns False on any mismatch """
+    import pixels as px
+    import strips
+    from fake_spi import RecordingSpiFactory
+    from headless_controller import HeadlessController
+
+    configs = [strips.StripConfig(port=0, device=0, length=30),
+               strips.StripConfig(port=1, device=0, length=20, offset=30, channel_order='grb'),
+               strips.StripConfig(port=1, device=1, length=10, offset=50, channel_order='bgr')]
+    factory = RecordingSpiFactory()
+    multi = strips.MultiStrip(configs, factory)
+    n_pix = multi.count()
+    rng = np.random.default_rng(0)
+
+    def check(label, frame):
+        for config, spi in zip(configs, factory.devices):
+            section = frame[config.offset:config.offset + config.length]
+            if spi.last_frame() != px.frame_to_bytes(section, config.channel_order).tobytes():
+                failures.append(f"{label} spi{spi.port}.{spi.device}")
+
+    failures = []
+    for i in range(frames):
+        frame = rng.integers(0, 256, (n_pix, 3), dtype=np.uint8)
+        strips.show_frame(multi, frame)
+        check(f"uint8 frame {i}", frame)
+        frame = rng.uniform(-20, 280, (n_pix, 3))
+        strips.show_frame(multi, frame)
+        check(f"float frame {i}", frame)
+
+    # Through the controller's output path
+    factory = RecordingSpiFactory()
+    controller = HeadlessController(strip_configs=configs, spi_factory=factory, clock=lambda: 0.)
+    controller.restore({'pattern': 'pulse', 'brightness': 0.8, 'saturation': 0.7, 'hue': 90})
+    for i in range(frames):
+        frame = controller.render_frame(i / 60)
+        controller.show_frame(controller.pixels, frame)
+        check(f"controller frame {i}", frame)
+
+    strips.turn_off(controller.pixels)
+    check("turn_off", np.zeros((n_pix, 3), dtype=np.uint8))
+
+    for failure in failures:
+        print(f"MISMATCH {failure}")
+    print(f"strips: {len(configs)} strips x {frames * 3} frames + turn_off, "
+          f"{len(failures)} mismatches")
+    return not failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='All of the Lights benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    output_parser = subparsers.add_parser('output', help='Frame output to SPI')
+    output_parser.add_argument('--pixels', type=int, nargs='+', default=[50, 500, 5000],
+                               help='Pixel counts to benchmark')
+    output_parser.add_argument('--repeats', type=int, default=200,
+                               help='Frames pushed per pixel count')
+
+    sparks_parser = subparsers.add_parser('sparks', help='Sparks pattern render cost')
+    sparks_parser.add_argument('--pixels', type=int, nargs='+', default=[50, 500, 5000, 10000],
+                               help='Pixel counts to benchmark')
+    sparks_parser.add_argument('--repeats', type=int, default=200,
+                               help='Frames rendered per pixel count')
+
+    contention_parser = subparsers.add_parser('contention',
+                                              help='Render jitter under concurrent API writes')
+    contention_parser.add_argument('--clients', type=int, default=50,
+                                   help='Concurrent clients posting brightness')
+    contention_parser.add_argument('--seconds', type=float, default=2.0,
+                                   help='Measurement time, idle and under load')
+    contention_parser.add_argument('--pixels', type=int, default=50,
+                                   help='Number of pixels')
+
+    metrics_parser = subparsers.add_parser('metrics', help='Overhead of the stage timing metrics')
+    metrics_parser.add_argument('--pixels', type=int, nargs='+', default=[50, 500, 5000],
+                                help='Pixel counts to benchmark')
+    metrics_parser.add_argument('--seconds', type=float, default=2.0,
+                                help='Time to run the loop per pixel count')
+    metrics_parser.add_argument('--repeats', type=int, default=100000,
+                                help='Calls to time the instrumentation over')
+
+    suite_parser = subparsers.add_parser('suite', help='Render cost of every pattern and mode')
+    suite_parser.add_argument('--pixels', type=int, nargs='+', default=[50, 500, 1000, 5000, 10000],
+                              help='Pixel counts to benchmark')
+    suite_parser.add_argument('--frames', type=int, default=200,
+                              help='Frames rendered per case')
+    suite_parser.add_argument('--output', help='Write results to this JSON file')
+    suite_parser.add_argument('--baseline', help='Compare against results from an earlier --output')
+    suite_parser.add_argument('--threshold', type=float, default=0.2,
+                              help='Fraction of baseline fps a case may lose before failing')
+
+    pipeline_parser = subparsers.add_parser('pipeline', help='Serial vs pipelined output')
+    pipeline_parser.add_argument('--pixels', type=int, default=1000, help='Number of pixels')
+    pipeline_parser.add_argument('--spi-hz', type=float, default=8e6,
+                                 help='Simulated SPI clock rate')
+    pipeline_parser.add_argument('--seconds', type=float, default=2.0,
+                                 help='Time to run each mode')
+
+    coldstart_parser = subparsers.add_parser('coldstart',
+                                             help='Import time and time to first frame at startup')
+    coldstart_parser.add_argument('--runs', type=int, default=5,
+                                  help='Process launches per startup path, the median is reported')
+    coldstart_parser.add_argument('--pixels', type=int, default=50, help='Number of pixels')
+
+    verify_parser = subparsers.add_parser('verify',
+                                          help='Check the bytes written to fake SPI devices, '
+                                               'for one strip and for several')
+    verify_parser.add_argument('--pixels', type=int, default=50, help='Number of pixels')
+    verify_parser.add_argument('--frames', type=int, default=20,
+                               help='Frames checked per pattern')
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'output':
+        bench_output(args.pixels, args.repeats)
+    elif args.benchmark == 'sparks':
+        bench_sparks(args.pixels, args.repeats)
+    elif args.benchmark == 'contention':
+        bench_contention(args.clients, args.seconds, args.pixels)
+    elif args.benchmark == 'metrics':
+        bench_metrics(args.pixels, args.seconds, args.repeats)
+    elif args.benchmark == 'suite':
+        if not bench_suite(args.pixels, args.frames, args.output, args.baseline, args.threshold):
+            sys.exit(1)
+    elif args.benchmark == 'pipeline':
+        bench_pipeline(args.pixels, args.spi_hz, args.seconds)
+    elif args.benchmark == 'coldstart':
+        bench_coldstart(args.runs, args.pixels)
+    elif args.benchmark == 'verify':
+        output_ok = verify_output(args.pixels, args.frames)
+        if not (verify_strips(args.frames) and output_ok):
+            sys.exit(1)
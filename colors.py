@@ -2,40 +2,76 @@
 modify RGB color values """
 
 import random
+from functools import lru_cache
 import numpy as np
+from frames import PATTERN_DTYPE
 
-def wheel(pos, ret_rgb=False, saturation=100):
-    # NOTE: the ret_rgb argument is useless
-    # Remove in future and remove all instances
-    # in the rest of the code
-    desaturate = 255 - (saturation * 255.)
+def _wheel_rgb(pos):
     if pos < 85:
-        rgb = [pos * 3, 255 - pos * 3, 0]
+        return [pos * 3, 255 - pos * 3, 0]
     elif pos < 170:
         pos -= 85
-        rgb = [255 - pos * 3, 0, pos * 3]
+        return [255 - pos * 3, 0, pos * 3]
     else:
         pos -= 170
-        rgb = [0, pos * 3, 255 - pos * 3]
+        return [0, pos * 3, 255 - pos * 3]
+
+# Fully saturated color for each of the 256 wheel positions
+WHEEL_TABLE = np.array([_wheel_rgb(pos) for pos in range(256)], dtype=PATTERN_DTYPE)
+WHEEL_TABLE.flags.writeable = False
+
+@lru_cache(maxsize=64)
+def wheel_table(saturation=1.0):
+    """ Wheel table desaturated by raising every channel to
+    at least 255 - (saturation * 255). Cached per saturation """
+    desaturate = 255 - (saturation * 255.)
+    table = np.maximum(WHEEL_TABLE, desaturate)
+    table.flags.writeable = False
+    return table
+
+def wheel_array(positions, saturation=1.0):
+    """ Vectorized wheel. Takes an array of wheel positions (0-255,
+    wrapping) and returns an (n, 3) array of rgb values """
+    positions = np.asarray(positions).astype(int) % 256
+    return wheel_table(saturation)[positions]
+
+def wheel(pos, ret_rgb=False, saturation=100):
+    # NOTE: the ret_rgb argument is useless
+    # Remove in future and remove all instances
+    # in the rest of the code
     if ret_rgb:
-        rgb = np.maximum(rgb, desaturate)
-        return rgb
+        return wheel_table(saturation)[int(pos) % 256].copy()
 
 def random_rgb():
     return (random.randint(0, 255),
             random.randint(0, 255),
             random.randint(0, 255))
 
-def shift(rgb, warm_rgb, amount, boost=0.4):
-    """ Applies the color ratio of warm_rgb to 
-    rgb by the amount (0-100). Floor boosts
-    how much shifting happens even when amount
-    is low"""
+@lru_cache(maxsize=64)
+def shift_factor(warm_rgb, amount, boost=0.4):
+    """ Per channel multiplier used by shift. Cached per
+    (warm_rgb, amount, boost) since it only changes when the
+    warm color or saturation does. warm_rgb must be a tuple """
     amount = min(amount * (1 + boost), 1.)
     retain = 1. - amount
     # retain = np.minimum(retain * (1 + boost), 1.)
     warm_rgb = np.asarray(warm_rgb)
     warm_ratio = warm_rgb / float(max(warm_rgb))
     gap = 1 - warm_ratio
-    shift = warm_ratio + (gap * retain)
-    return (rgb * shift).astype(int)
\ No newline at end of file
+    # Match the frame dtype so multiplying a frame by it doesn't upcast
+    factor = (warm_ratio + (gap * retain)).astype(PATTERN_DTYPE)
+    factor.flags.writeable = False
+    return factor
+
+def shift(rgb, warm_rgb, amount, boost=0.4, out=None):
+    """ Applies the color ratio of warm_rgb to 
+    rgb by the amount (0-100). Floor boosts
+    how much shifting happens even when amount
+    is low. rgb can be a single color or a whole
+    (n, 3) frame. With out, the truncated result
+    is written there instead of a new int array """
+    factor = shift_factor(tuple(warm_rgb), amount, boost)
+    if out is None:
+        return (rgb * factor).astype(int)
+    np.multiply(rgb, factor, out=out)
+    return np.trunc(out, out=out)
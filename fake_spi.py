@@ -0,0 +1,96 @@
+""" Contains RecordingSpi, a stand-in for Adafruit_GPIO.SPI.SpiDev
+that records every byte written to it, so the full output path can
+be run and checked without a Pi or any strips attached """
+
+import threading
+import time
+from collections import deque
+
+
+class _RecordingDevice:
+    """ Mimics the spidev.SpiDev handle that pixels.write_bytes
+    writes frames to directly """
+
+    def __init__(self, spi):
+        self._spi = spi
+
+    def writebytes(self, data):
+        self._spi._record(data)
+
+    def writebytes2(self, data):
+        self._spi._record(data)
+
+
+class RecordingSpi:
+    """ Records writes as (monotonic timestamp, bytes), keeping the most
+    recent max_records. If clock_hz is given each write takes as long as
+    it would on a real bus at that rate. With max_records=0 writes are
+    only counted, not copied, which makes it a null or timed sink """
+
+    def __init__(self, port=0, device=0, clock_hz=None, max_records=1000):
+        self.port = port
+        self.device = device
+        self.clock_hz = clock_hz
+        self.records = deque(maxlen=max_records)
+        self.writes = 0
+        self.bytes_written = 0
+        self.bus_clock_hz = None  # As set by the driver
+        self._device = _RecordingDevice(self)
+        self._lock = threading.Lock()
+
+    def set_clock_hz(self, hz):
+        self.bus_clock_hz = hz
+
+    def set_mode(self, mode):
+        pass
+
+    def set_bit_order(self, order):
+        pass
+
+    def write(self, data):
+        self._record(data)
+
+    def _record(self, data):
+        start = time.monotonic()
+        nbytes = getattr(data, 'nbytes', None) or len(data)
+        if self.clock_hz:
+            time.sleep(nbytes * 8 / self.clock_hz)
+        with self._lock:
+            if self.records.maxlen != 0:
+                self.records.append((start, bytes(data)))
+            self.writes += 1
+            self.bytes_written += nbytes
+
+    def last_frame(self):
+        """Bytes of the most recent write, None if nothing was written"""
+        with self._lock:
+            return self.records[-1][1] if self.records else None
+
+    def get_stats(self):
+        """Get write counts and throughput over the recorded writes"""
+        with self._lock:
+            records = list(self.records)
+            stats = {'port': self.port,
+                     'device': self.device,
+                     'writes': self.writes,
+                     'bytes_written': self.bytes_written}
+        if len(records) >= 2:
+            span = records[-1][0] - records[0][0]
+            recorded_bytes = sum(len(data) for _, data in records[1:])
+            stats['writes_per_second'] = round((len(records) - 1) / span, 2) if span > 0 else 0.0
+            stats['bytes_per_second'] = round(recorded_bytes / span, 1) if span > 0 else 0.0
+        return stats
+
+
+class RecordingSpiFactory:
+    """ spi_factory that opens RecordingSpi devices and keeps them for inspection """
+
+    def __init__(self, clock_hz=None, max_records=1000):
+        self.clock_hz = clock_hz
+        self.max_records = max_records
+        self.devices = []
+
+    def __call__(self, port, device):
+        spi = RecordingSpi(port, device, self.clock_hz, self.max_records)
+        self.devices.append(spi)
+        return spi
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Fast start entry point for the API server. Restores the saved state and
+shows the first frame before Flask is even imported, then brings up the
+API, with CORS and auto-save started afterwards and presets created on
+first use. Takes the same options as api_server.py.
+"""
+
+import time
+_process_start = time.perf_counter()
+
+import argparse
+
+
+def build_parser():
+    """Command line options shared by api_server.py and fast_start.py"""
+    parser = argparse.ArgumentParser(description='All of the Lights API Server')
+    parser.add_argument('--no-lights', action='store_true',
+                       help='Run in simulation mode without actual lights')
+    parser.add_argument('--show-animation', action='store_true',
+                       help='Show pygame animation window (works with --no-lights)')
+    parser.add_argument('--pixels', type=int, default=50,
+                       help='Number of pixels on the strip, or in simulation mode')
+    parser.add_argument('--fps', type=float, default=60,
+                       help='Target frame rate of the render loop')
+    parser.add_argument('--loop-cache-mb', type=float, default=0,
+                       help='Memory budget for precomputed pattern cycles (0 disables)')
+    parser.add_argument('--pipelined', action='store_true',
+                       help='Write frames out on a separate thread while the next renders')
+    parser.add_argument('--fake-spi', type=float, nargs='?', const=0, default=None, metavar='HZ',
+                       help='Record output on fake SPI devices, optionally taking as long as a bus at HZ')
+    parser.add_argument('--strips',
+                       help='JSON file of strips (port, device, length, offset) to drive as one')
+    parser.add_argument('--state-dir',
+                       help='Directory for saved state and presets (default ~/.all_of_the_lights)')
+    parser.add_argument('--state-journal', action='store_true',
+                       help='Append setting changes to a journal instead of rewriting the state file')
+    parser.add_argument('--host', default='0.0.0.0',
+                       help='Host to bind to')
+    parser.add_argument('--port', type=int, default=5000,
+                       help='Port to bind to')
+    parser.add_argument('--debug', action='store_true',
+                       help='Run in debug mode')
+    return parser
+
+
+def start_lights(use_lights=True, n_pixels=50, show_animation=False, target_fps=60,
+                 loop_cache_mb=0, pipelined=False, strip_configs=None, fake_spi_hz=None,
+                 state_dir=None, state_journal=False):
+    """Start the light service with the last saved state already applied,
+    importing only what the output needs
+
+    Returns:
+        tuple: (light_service, state_manager, fake_spi_factory)
+    """
+    from light_service import get_light_service
+    from state_manager import StateManager
+
+    # Record SPI output instead of driving real strips. 0 means no bus timing
+    fake_spi_factory = None
+    if fake_spi_hz is not None:
+        from fake_spi import RecordingSpiFactory
+        fake_spi_factory = RecordingSpiFactory(clock_hz=fake_spi_hz or None)
+
+    light_service = get_light_service(use_lights=use_lights, n_pixels=n_pixels,
+                                      show_animation=show_animation, target_fps=target_fps,
+                                      loop_cache_mb=loop_cache_mb, pipelined=pipelined,
+                                      strip_configs=strip_configs, spi_factory=fake_spi_factory)
+
+    # Restore previous state before the render loop starts, so the
+    # first frame shows it rather than the defaults
+    state_manager = StateManager(state_dir, journal=state_journal)
+    if state_manager.state_exists():
+        result = state_manager.apply_state_to_service(light_service)
+        print(f"State restoration: {result.get('message', 'Unknown result')}")
+
+    if not light_service.initialize():
+        raise RuntimeError("Failed to initialize light service")
+    first_frame_ms = light_service.get_frame_stats().get('first_frame_ms')
+    if first_frame_ms is not None:
+        print(f"First frame shown {first_frame_ms} ms after the render loop started")
+
+    return light_service, state_manager, fake_spi_factory
+
+
+def main():
+    args = build_parser().parse_args()
+
+    try:
+        strip_configs = None
+        if args.strips:
+            from strips import load_strip_config
+            strip_configs = load_strip_config(args.strips)
+
+        services = start_lights(use_lights=not args.no_lights, n_pixels=args.pixels,
+                                show_animation=args.show_animation, target_fps=args.fps,
+                                loop_cache_mb=args.loop_cache_mb, pipelined=args.pipelined,
+                                strip_configs=strip_configs, fake_spi_hz=args.fake_spi,
+                                state_dir=args.state_dir, state_journal=args.state_journal)
+        print(f"Lights up {(time.perf_counter() - _process_start) * 1000:.0f} ms after start")
+
+        # Everything else only once the lights are showing
+        import api_server
+        api_server.use_services(*services, state_dir=args.state_dir)
+        api_server.serve(args)
+
+    except Exception as e:
+        print(f"Failed to start server: {e}")
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
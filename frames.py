@@ -0,0 +1,29 @@
+""" Defines the dtypes frames are stored in as they move
+through the render pipeline, and the conversions between them.
+Patterns and mutes work in PATTERN_DTYPE. Everything after
+master dimming is OUTPUT_DTYPE, ready to go out on the wire """
+
+import numpy as np
+
+PATTERN_DTYPE = np.float32
+OUTPUT_DTYPE = np.uint8
+
+def pattern_buffer(shape):
+    """ Zeroed buffer for pattern or mute values """
+    return np.zeros(shape, dtype=PATTERN_DTYPE)
+
+def output_buffer(shape):
+    """ Zeroed buffer for dimmed frames """
+    return np.zeros(shape, dtype=OUTPUT_DTYPE)
+
+def to_output(frame, factor, out, scratch=None):
+    """ Scales frame by factor (a number or an array of the
+    frame shape) and saturates the result into the uint8 out.
+    Values are clamped to 0-255 and truncated like int().
+    scratch is a PATTERN_DTYPE buffer for the intermediate """
+    if scratch is None:
+        scratch = pattern_buffer(frame.shape)
+    np.multiply(frame, factor, out=scratch)
+    np.clip(scratch, 0, 255, out=scratch)
+    np.copyto(out, scratch, casting="unsafe")
+    return out
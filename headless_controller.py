@@ -5,19 +5,144 @@ import argparse
 import random
 import time
 import threading
+from collections import namedtuple
+from contextlib import contextmanager
 import numpy as np
 from constants import *
 from patterns import droplets, orbits, pixel_train, pulse, sparks, solid
 from phase import calculate_phase, modify_phase
-from mute import flicker, gradual, instant
+from mute import SILENT_AFTER, fade_in, fade_out, flicker, gradual, instant, is_silent
+from scheduler import FrameScheduler
+from frames import output_buffer, pattern_buffer, to_output
+from loop_cache import LoopCache
+from metrics import FrameMetrics
+from profiler import cprofile_report, sample_thread, start_cprofile
+from pipeline import LatestFrame
+
+
+# Immutable snapshot of everything the render loop reads. Setters publish
+# a modified copy (copy-on-write) so the loop can read the whole set with
+# one reference load and never takes the controller lock
+ControllerParams = namedtuple('ControllerParams', [
+    'version',       # Bumped on every change, used to tell if a frame can change
+    'function', 'brightness', 'saturation', 'hue', 'speed_factor', 'tempo', 'cycle_time',
+    'alt', 'warm_shift', 'warm_rgb', 'mute', 'mute_fn', 'mute_start', 'static_mode',
+    'sunrise',       # Sunrise while one is running, else None
+    'transitions'    # Parameter name -> active Transition. Replaced, never modified
+])
+
+Sunrise = namedtuple('Sunrise', [
+    'start_time', 'duration',
+    'start_brightness', 'end_brightness',
+    'start_hue', 'end_hue',              # degrees
+    'start_saturation', 'end_saturation'
+])
+
+
+def sunrise_values(sunrise, now):
+    """Interpolate a sunrise at time now. Returns (progress, brightness, hue, saturation)
+    with hue on the 0-255 color wheel"""
+    progress = min(1.0, (now - sunrise.start_time) / sunrise.duration)
+    brightness = sunrise.start_brightness + (
+        sunrise.end_brightness - sunrise.start_brightness) * progress
+    hue_deg = sunrise.start_hue + (sunrise.end_hue - sunrise.start_hue) * progress
+    saturation = sunrise.start_saturation + (
+        sunrise.end_saturation - sunrise.start_saturation) * progress
+    return progress, brightness, int(hue_deg * 255 / 360), saturation
+
+
+# Easing curves, mapping linear progress 0-1 to eased progress 0-1
+EASINGS = {
+    'linear': lambda p: p,
+    'ease_in': lambda p: p * p,
+    'ease_out': lambda p: 1.0 - (1.0 - p) ** 2,
+    'ease_in_out': lambda p: 2 * p * p if p < 0.5 else 1.0 - 2 * (1.0 - p) ** 2,
+}
+
+# Parameters that can be transitioned
+TRANSITION_PARAMS = ('brightness', 'saturation', 'hue', 'speed_factor', 'tempo')
+
+PATTERNS = {
+    'pulse': pulse,
+    'pixel_train': pixel_train,
+    'droplets': droplets,
+    'orbits': orbits,
+    'sparks': sparks,
+    'solid': solid
+}
+
+MUTE_TYPES = {
+    'instant': instant,
+    'gradual': gradual,
+    'flicker': flicker,
+    'fade_out': fade_out,
+    'fade_in': fade_in
+}
+
+Transition = namedtuple('Transition', ['start_value', 'target', 'start_time', 'duration', 'easing'])
+
+
+def transition_value(transition, now):
+    """Value of a transition at time now. Returns (value, finished)"""
+    progress = (now - transition.start_time) / transition.duration
+    if progress >= 1.0:
+        return transition.target, True
+    eased = EASINGS[transition.easing](max(0.0, progress))
+    return transition.start_value + (transition.target - transition.start_value) * eased, False
+
+
+def current_values(params, now):
+    """Values of the animated parameters at time now, with transitions
+    and any sunrise applied. Returns (values, finished) where finished
+    holds the transitions that have reached their target"""
+    values = {'brightness': params.brightness,
+              'saturation': params.saturation,
+              'hue': params.hue,
+              'speed_factor': params.speed_factor,
+              'tempo': params.tempo,
+              'cycle_time': params.cycle_time}
+    finished = []
+    for name, transition in params.transitions.items():
+        values[name], done = transition_value(transition, now)
+        if done:
+            finished.append((name, transition))
+    if 'tempo' in params.transitions:
+        values['cycle_time'] = 60000 / values['tempo']
+    values['hue'] = int(values['hue'] % 256)  # Hue fades can cross the end of the wheel
+
+    # A running sunrise overrides the colour and brightness
+    if params.sunrise is not None:
+        _, values['brightness'], values['hue'], values['saturation'] = sunrise_values(
+            params.sunrise, now)
+    return values, finished
+
+
+class _RenderState:
+    """ Buffers and running state for rendering a sequence of frames """
+
+    def __init__(self, shape, start_time, metrics):
+        self.metrics = metrics  # FrameMetrics the stage timings go to
+        # Frame buffers, reused every frame so rendering does not allocate.
+        # Pattern math is float32, everything from dimming on is uint8
+        self.rgb_values = pattern_buffer(shape)       # Pattern output
+        self.mute_values = pattern_buffer(shape)      # Mute dimming factors
+        self.scratch = pattern_buffer(shape)          # Dimming intermediate
+        self.frame = output_buffer(shape)             # After dimming and mute
+        self.cache = {}                               # Pattern state
+        self.cycles = 0.0  # Pattern cycles so far, accumulated so tempo changes don't jump the phase
+        self.last_time = start_time
 
 
 class HeadlessController:
     """ Light controller that runs without curses interface for API usage """
 
-    def __init__(self, use_lights=True, n_pixels=50, show_animation=False):
+    def __init__(self, use_lights=True, n_pixels=50, show_animation=False, target_fps=60,
+                 loop_cache_mb=0, clock=time.monotonic, pipelined=False, pixels=None,
+                 strip_configs=None, spi_factory=None):
         self.use_lights = use_lights
+        self._clock = clock  # Seconds, used for all animation and fade timing
         self.show_animation = show_animation
+        self._strips = None  # MultiStrip when driving several strips
 
         if not use_lights:
             if show_animation:
@@ -30,11 +155,24 @@ class HeadlessController:
                 self.n_pix = n_pixels
         else:
             try:
-                from pixels import get_pixels, set_all_values, turn_off
+                from pixels import get_pixels, set_all_values, show_frame, turn_off
+                import strips
+                if pixels is None:
+                    # spi_factory(port, device) swaps in another SPI device, e.g. fake_spi
+                    spi_kwargs = {'spi_factory': spi_factory} if spi_factory is not None else {}
+                    if strip_configs:
+                        pixels = strips.MultiStrip(strip_configs, **spi_kwargs)
+                    else:
+                        pixels = get_pixels(n_pixels, **spi_kwargs)
+                if isinstance(pixels, strips.MultiStrip):
+                    # Several strips written in parallel as one frame
+                    show_frame, turn_off = strips.show_frame, strips.turn_off
+                    self._strips = pixels
                 self.get_pixels = get_pixels
                 self.set_all_values = set_all_values
+                self.show_frame = show_frame
                 self.turn_off = turn_off
-                self.pixels = get_pixels()
+                self.pixels = pixels
                 self.n_pix = self.pixels.count()
                 self.output = "lights"
             except ImportError:
@@ -43,42 +181,60 @@ class HeadlessController:
                 self.n_pix = n_pixels
 
         # Initialize state
-        self.saturation = 0.0
         self.freq = 1
-        self.tempo = 60
-        self.cycle_time = 1000
         self.curr_cycle = 0
-        self.speed_factor = 1
-        self.function = pulse
-        self.brightness = 1.0
-        self.hue = 30  # Default to warm orange/amber (30 on color wheel)
-        self.warm_shift = True
-        self.warm_rgb = CANDLE
         self.shape = (self.n_pix, 3)
-        self.mute = False
-        self.mute_fn = instant
-        self.mute_start = None
-        self.alt = True
-        self._updating = False  # Flag to pause rendering during atomic updates
-        self._static_mode = False  # Flag for static patterns that don't need continuous updates
-        self._static_rendered = False  # True when static frame has been written to SPI
-
-        # Sunrise state
-        self._sunrise_active = False
-        self._sunrise_start_time = None
-        self._sunrise_duration = 1800  # seconds (30 min default)
-        self._sunrise_start_brightness = 0.0
-        self._sunrise_end_brightness = 0.8
-        self._sunrise_start_hue = 20  # deep orange/red
-        self._sunrise_end_hue = 40    # warm white
-        self._sunrise_start_saturation = 0.6
-        self._sunrise_end_saturation = 0.05
-
-        # Threading controls
+        self._params = ControllerParams(
+            version=0,
+            function=pulse,
+            brightness=1.0,
+            saturation=0.0,
+            hue=30,  # Default to warm orange/amber (30 on color wheel)
+            speed_factor=1,
+            tempo=60,
+            cycle_time=1000,
+            alt=True,
+            warm_shift=True,
+            warm_rgb=CANDLE,
+            mute=False,
+            mute_fn=instant,
+            mute_start=None,
+            static_mode=False,  # Static patterns don't need continuous updates
+            sunrise=None,
+            transitions={}
+        )
+        self._transactions = []  # Staged changes for the loop to apply at the next frame
+        self.frame_number = 0  # Frames rendered, by the loop or render_frame
+        self.frames_rendered_offline = 0  # Of those, frames rendered by render_frame
+        self._frame_state = None  # Rendering state for render_frame
+
+        # Frame pacing
+        self._scheduler = FrameScheduler(target_fps)
+
+        # Precomputed pattern cycles, off unless given a memory budget
+        self._loop_cache = LoopCache(int(loop_cache_mb * 1024 * 1024)) if loop_cache_mb > 0 else None
+
+        # Output stats
+        self.frames_written = 0  # Frames pushed to the output
+        self.frames_skipped = 0  # Frames identical to the last one written, not pushed
+        self._started_at = None  # perf_counter() when start() was called
+        self.first_frame_ms = None  # Time from start() to the first frame shown
+        self._first_frame = threading.Event()
+        self._metrics = FrameMetrics()
+        self._frame_metrics = FrameMetrics()  # render_frame timings, kept out of the loop's
+        self._profile_request = None  # Set while the API is profiling the render loop
+
+        # Pipelined output: a separate thread clocks out the newest frame
+        # while the render loop works on the next one
+        self._output_frames = LatestFrame(self.shape) if pipelined and self.output == "lights" else None
+        self._output_thread = None
+
+        # Threading controls. The lock only serializes writers, the
+        # render loop reads self._params without it
         self._running = False
         self._thread = None
-        self._fade_thread = None
         self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)  # Notified on every parameter change
         self._wake_event = threading.Event()  # Used to wake the loop in static mode
 
     def start(self):
@@ -87,7 +243,14 @@ class HeadlessController:
             if self._running:
                 return False
             self._running = True
-
+            self._started_at = time.perf_counter()
+            self.first_frame_ms = None
+            self._first_frame.clear()
+
+        if self._output_frames is not None:
+            self._output_frames.reopen()  # Closed when the last run stopped
+            self._output_thread = threading.Thread(target=self._output_loop, daemon=True)
+            self._output_thread.start()
         self._thread = threading.Thread(target=self._run_loop, daemon=True)
         self._thread.start()
         return True
@@ -105,224 +268,373 @@ class HeadlessController:
         if self.output == "lights":
             self.turn_off(self.pixels)
 
-    def _request_render(self):
-        """Mark that a new frame needs to be rendered and wake the loop"""
-        self._static_rendered = False
+    def _update(self, **changes):
+        """Publish a new parameter snapshot with changes applied and wake
+        the loop. Callers must hold self._lock so writers don't race"""
+        params = self._params
+        self._params = params._replace(version=params.version + 1, **changes)
+        self._wake_event.set()
+        self._changed.notify_all()
+
+    def wait_for_change(self, version, timeout=None):
+        """Block until the parameters are at a version other than version,
+        or timeout seconds pass. Returns the current version"""
+        with self._changed:
+            self._changed.wait_for(lambda: self._params.version != version, timeout)
+            return self._params.version
+
+    def commit(self, changes, timeout=1.0):
+        """Stage a set of parameter changes (ControllerParams fields) for the
+        render loop to apply together at the next frame boundary.
+        Returns the number of the first frame rendered with the changes,
+        or None if the loop did not pick them up within timeout seconds"""
+        transaction = {'changes': changes, 'done': threading.Event(), 'frame': None}
+        with self._lock:
+            if not self._running:
+                # No loop to hand over to, the next frame will have them anyway
+                self._apply_changes(changes)
+                return self.frame_number
+            self._transactions.append(transaction)
         self._wake_event.set()
 
+        transaction['done'].wait(timeout)
+        return transaction['frame']
+
+    def _step_profile(self):
+        """Start or finish a requested cProfile run. Called by the render
+        loop between frames so only the render thread is profiled"""
+        request = self._profile_request
+        if request['profiler'] is None:
+            request['profiler'] = start_cprofile()
+        elif request['stop']:
+            request['report'] = cprofile_report(request['profiler'])
+            self._profile_request = None
+            request['done'].set()
+
+    def _loop_work_pending(self):
+        """True if a transaction or a profile start or stop is waiting for the loop"""
+        request = self._profile_request
+        return bool(self._transactions) or (
+            request is not None and (request['profiler'] is None or request['stop']))
+
+    @contextmanager
+    def _loop_lock(self, metrics):
+        """Take the controller lock from the render loop, counting the wait"""
+        wait_start = time.perf_counter()
+        with self._lock:
+            metrics.lock_wait_seconds += time.perf_counter() - wait_start
+            yield
+
+    def _apply_transactions(self, metrics):
+        """Apply all staged transactions as one snapshot. Called by the
+        render loop between frames"""
+        with self._loop_lock(metrics):
+            transactions, self._transactions = self._transactions, []
+            merged = {}
+            for transaction in transactions:
+                merged.update(transaction['changes'])
+            self._apply_changes(merged)
+        for transaction in transactions:
+            transaction['frame'] = self.frame_number
+            transaction['done'].set()
+
+    def _apply_changes(self, changes):
+        """Publish changes, cancelling transitions on the parameters they set and
+        starting or clearing the mute clock if mute changes"""
+        changes = dict(changes)
+        if any(name in self._params.transitions for name in changes):
+            changes['transitions'] = {name: transition
+                                      for name, transition in self._params.transitions.items()
+                                      if name not in changes}
+        if 'mute' in changes and 'mute_start' not in changes:
+            if changes['mute'] and not self._params.mute_start:
+                changes['mute_start'] = self._clock()
+            elif not changes['mute']:
+                changes['mute_start'] = None
+        self._update(**changes)
+
+    def _start_transition(self, name, target, duration, easing='ease_out'):
+        """Move a parameter to target over duration seconds, replacing any
+        transition already running on it. Callers must hold self._lock"""
+        params = self._params
+        transitions = dict(params.transitions)
+        if duration <= 0:
+            transitions.pop(name, None)
+            changes = {name: target, 'transitions': transitions}
+        else:
+            # Start from wherever the parameter is right now, mid transition or not
+            now = self._clock()
+            start_value = current_values(params._replace(sunrise=None), now)[0][name]
+            if name == 'hue':
+                # Go the short way round the wheel, so 250 -> 5 passes through
+                # 0 rather than every other colour. Wrapped in current_values
+                start_value = target + (start_value - target + 128) % 256 - 128
+            transitions[name] = Transition(start_value, target, now, duration, easing)
+            changes = {'transitions': transitions}
+        if name == 'tempo' and name not in transitions:
+            changes['cycle_time'] = 60000 / target  # Convert BPM to milliseconds per cycle
+        self._update(**changes)
+
+    def _finish_transitions(self, finished, metrics):
+        """Make the targets of completed transitions the current values"""
+        with self._loop_lock(metrics):
+            transitions = dict(self._params.transitions)
+            changes = {}
+            for name, transition in finished:
+                # Skip transitions that have been replaced in the meantime
+                if transitions.get(name) is transition:
+                    del transitions[name]
+                    changes[name] = transition.target
+                    if name == 'tempo':
+                        changes['cycle_time'] = 60000 / transition.target
+            if changes:
+                self._update(transitions=transitions, **changes)
+
+    def _finish_sunrise(self, sunrise, metrics):
+        """Make a completed sunrise's end values the current parameters"""
+        with self._loop_lock(metrics):
+            # Skip if the sunrise was cancelled or restarted in the meantime
+            if self._params.sunrise is sunrise:
+                _, brightness, hue, saturation = sunrise_values(sunrise, sunrise.start_time + sunrise.duration)
+                self._update(brightness=brightness, hue=hue, saturation=saturation, sunrise=None)
+
+    def _render(self, state, params, now):
+        """Render the frame for params at time now into state.frame.
+        Returns True if the frame is fully muted and will stay black"""
+        metrics = state.metrics
+        perf_counter = time.perf_counter
+
+        # Transitions and sunrise interpolation
+        values, finished = current_values(params, now)
+        if finished:
+            self._finish_transitions(finished, metrics)
+        if params.sunrise is not None:
+            if now - params.sunrise.start_time >= params.sunrise.duration:
+                self._finish_sunrise(params.sunrise, metrics)
+
+        # Timing
+        state.cycles += (now - state.last_time) * 1000 / values['cycle_time']
+        state.last_time = now
+        phase, n_cycles = calculate_phase(state.cycles, 1.0)
+
+        # Speeding up or slowing down phase
+        curr_speed = values['speed_factor']
+        if params.function == pixel_train:
+            curr_speed /= 4.0
+        phase, direction = modify_phase(phase, n_cycles, curr_speed)
+
+        kwargs = {"shape": self.shape,
+                  "n_cycles": n_cycles,
+                  "saturation": values['saturation'],
+                  "hue": values['hue'],
+                  "warm_rgb": params.warm_rgb,
+                  "warm_shift": params.warm_shift,
+                  "alt": params.alt,
+                  "loop_start": now,
+                  "loop_cache": self._loop_cache}
+
+        # Generate new colors
+        stage_start = perf_counter()
+        frame, state.cache = params.function(phase, state.cache, kwargs, out=state.rgb_values)
+        stage_end = perf_counter()
+        metrics.observe('render', stage_end - stage_start)
+
+        # Master dimming, saturated into uint8
+        stage_start = stage_end
+        to_output(frame, values['brightness'], state.frame, state.scratch)
+        metrics.observe('dimming', perf_counter() - stage_start)
+
+        # Mute functions
+        mute_silent = False
+        if params.mute and params.mute_start is not None:
+            stage_start = perf_counter()
+            elapsed_mute = (now - params.mute_start) * 1000
+            mute_factor = params.mute_fn(elapsed_mute, kwargs, out=state.mute_values)
+            to_output(state.frame, mute_factor, state.frame, state.scratch)
+            mute_silent = is_silent(params.mute_fn, elapsed_mute)
+            metrics.observe('mute', perf_counter() - stage_start)
+
+        return mute_silent
+
+    def render_frame(self, t, out=None):
+        """Render the frame for time t, in seconds on the controller's clock,
+        without threads or sleeping. Call with increasing t: the animation
+        advances by the time since the previous call. Returns the
+        (n_pixels, 3) uint8 frame, written into out if given. Stage timings
+        go to their own metrics, not the live loop's /api/metrics"""
+        if self._transactions:
+            self._apply_transactions(self._frame_metrics)
+        if self._frame_state is None:
+            self._frame_state = _RenderState(self.shape, t, self._frame_metrics)
+        self._render(self._frame_state, self._params, t)
+        self.frame_number += 1
+        self.frames_rendered_offline += 1
+        if out is None:
+            return self._frame_state.frame.copy()
+        np.copyto(out, self._frame_state.frame)
+        return out
+
     def _run_loop(self):
         """Main light processing loop"""
-        start_time = time.time()
-        rgb_values = np.zeros((self.n_pix, 3))
-        cache = {}
+        state = _RenderState(self.shape, self._clock(), self._metrics)
+        frame = state.frame
+        last_frame = output_buffer(self.shape)        # Last frame pushed to the output
+        unchanged = np.zeros(self.shape, dtype=bool)
+        frame_written = False
+        settled_version = None  # Params version whose frame cannot change any more
+        metrics = self._metrics
+        perf_counter = time.perf_counter
 
         try:
             while self._running:
-                # Timing
-                loop_start = time.time()
-                elapsed = (loop_start - start_time) * 1000
-                phase, n_cycles = calculate_phase(elapsed, self.cycle_time)
-
-                # Thread-safe access to parameters
-                with self._lock:
-                    # Skip rendering during atomic updates
-                    if self._updating:
-                        time.sleep(0.001)
-                        continue
-
-                    # Sunrise interpolation
-                    if self._sunrise_active and self._sunrise_start_time:
-                        elapsed_sunrise = loop_start - self._sunrise_start_time
-                        progress = min(1.0, elapsed_sunrise / self._sunrise_duration)
-
-                        self.brightness = self._sunrise_start_brightness + (
-                            self._sunrise_end_brightness - self._sunrise_start_brightness) * progress
-                        hue_deg = self._sunrise_start_hue + (
-                            self._sunrise_end_hue - self._sunrise_start_hue) * progress
-                        self.hue = int(hue_deg * 255 / 360)
-                        self.saturation = self._sunrise_start_saturation + (
-                            self._sunrise_end_saturation - self._sunrise_start_saturation) * progress
-
-                        if self._static_mode:
-                            self._static_rendered = False
-
-                        if progress >= 1.0:
-                            self._sunrise_active = False
-
-                    # Static mode: if already rendered and nothing changed, just sleep
-                    if self._static_mode and self._static_rendered:
-                        # Check if muting (need to animate the mute effect)
-                        if self.mute and self.mute_start:
-                            pass  # Fall through to render the mute animation
-                        else:
-                            # Nothing to do — sleep until woken by a parameter change
-                            self._wake_event.clear()
-                            # Release lock before sleeping
-                            lock_ref = self._lock
-                            lock_ref.release()
-                            try:
-                                # Wake every 0.5s to check sunrise progress, or immediately on param change
-                                self._wake_event.wait(timeout=0.5 if self._sunrise_active else 5.0)
-                            finally:
-                                lock_ref.acquire()
-                            continue
-
-                    curr_speed = self.speed_factor
-                    curr_function = self.function
-                    curr_brightness = self.brightness
-                    curr_saturation = self.saturation
-                    curr_hue = self.hue
-                    curr_warm_rgb = self.warm_rgb
-                    curr_warm_shift = self.warm_shift
-                    curr_alt = self.alt
-                    curr_mute = self.mute
-                    curr_mute_fn = self.mute_fn
-                    curr_mute_start = self.mute_start
-                    is_static = self._static_mode
-
-                # Speeding up or slowing down phase
-                if curr_function == pixel_train:
-                    curr_speed /= 4.0
-                phase, direction = modify_phase(phase, n_cycles, curr_speed)
-
-                kwargs = {"shape": self.shape,
-                          "n_cycles": n_cycles,
-                          "saturation": curr_saturation,
-                          "hue": curr_hue,
-                          "warm_rgb": curr_warm_rgb,
-                          "warm_shift": curr_warm_shift,
-                          "alt": curr_alt,
-                          "loop_start": loop_start}
-
-                # Generate new colors
-                rgb_values, cache = curr_function(phase, cache, kwargs)
-
-                # Master dimming
-                rgb_values_curr = (rgb_values * curr_brightness).astype(int)
-
-                # Mute functions
-                if curr_mute and curr_mute_start:
-                    elapsed_mute = (loop_start - curr_mute_start) * 1000
-                    rgb_values_curr = (rgb_values_curr * curr_mute_fn(elapsed_mute, kwargs)).astype(int)
-
-                # Set and show pixel values
-                if self.output == "lights":
-                    self.set_all_values(self.pixels, rgb_values_curr)
-                    self.pixels.show()
-                elif self.output == "animation":
-                    self.animation.update(rgb_values_curr)
-
-                # Mark static frame as rendered so we stop writing to SPI
-                if is_static and not curr_mute:
-                    with self._lock:
-                        self._static_rendered = True
-
-                # Sleep: animated patterns run at ~60fps
-                time.sleep(0.016)
+                # Frame boundary, apply any staged transactions
+                if self._transactions:
+                    self._apply_transactions(metrics)
+                if self._profile_request is not None:
+                    self._step_profile()
+
+                # Lock-free snapshot of all parameters
+                params = self._params
+
+                # Static frame or finished mute: nothing will change, just sleep
+                if settled_version == params.version:
+                    self._wake_event.clear()
+                    # Re-check after clearing so a change, transaction or profile
+                    # request published just before isn't missed
+                    if self._params.version == settled_version and not self._loop_work_pending():
+                        # Wake every 0.5s to check sunrise progress, or immediately on param change
+                        self._wake_event.wait(timeout=0.5 if params.sunrise else 5.0)
+                    if params.sunrise is not None:
+                        settled_version = None
+                    # Deadlines missed while idle are not dropped frames
+                    self._scheduler.reset()
+                    continue
+
+                mute_silent = self._render(state, params, self._clock())
+
+                # Skip the output entirely if nothing changed since the last frame
+                stage_start = perf_counter()
+                np.equal(frame, last_frame, out=unchanged)
+                if frame_written and unchanged.all():
+                    self.frames_skipped += 1
+                    metrics.observe('output', perf_counter() - stage_start)
+                else:
+                    np.copyto(last_frame, frame)
+                    frame_written = True
+                    stage_end = perf_counter()
+                    metrics.observe('output', stage_end - stage_start)
+
+                    # Set and show pixel values
+                    if self._output_frames is not None:
+                        # Hand off to the output thread and move on to the next frame
+                        self._output_frames.put(frame)
+                    else:
+                        stage_start = stage_end
+                        if self.output == "lights":
+                            self.show_frame(self.pixels, frame)
+                        elif self.output == "animation":
+                            self.animation.update(frame.astype(int))
+                        metrics.observe('show', perf_counter() - stage_start)
+                        if self.first_frame_ms is None:
+                            self._first_frame_shown()
+                    self.frames_written += 1
+                self.frame_number += 1
+
+                # Once a static frame or a fully muted (black) frame has been
+                # written, park the loop until a parameter changes
+                if (params.static_mode and not params.mute and not params.transitions) or mute_silent:
+                    settled_version = params.version
+
+                # Sleep until the next frame deadline
+                self._scheduler.wait()
 
         except Exception as e:
             print(f"Error in light loop: {e}")
         finally:
+            if self._output_thread is not None:
+                # Let the output thread finish its frame before blanking the strip
+                self._output_frames.close()
+                self._output_thread.join(timeout=1.0)
             if self.output == "lights":
                 self.turn_off(self.pixels)
 
+    def _first_frame_shown(self):
+        self.first_frame_ms = round((time.perf_counter() - self._started_at) * 1000, 2)
+        self._first_frame.set()
+
+    def wait_for_first_frame(self, timeout=None):
+        """Block until the loop has shown its first frame since start().
+        Returns False on timeout"""
+        return self._first_frame.wait(timeout)
+
+    def _output_loop(self):
+        """Pipelined output, shows each frame the render loop hands over"""
+        perf_counter = time.perf_counter
+        try:
+            while self._running:
+                frame = self._output_frames.take(timeout=0.5)
+                if frame is None:
+                    continue
+                stage_start = perf_counter()
+                self.show_frame(self.pixels, frame)
+                self._metrics.observe('show', perf_counter() - stage_start)
+                if self.first_frame_ms is None:
+                    self._first_frame_shown()
+        except Exception as e:
+            print(f"Error in output loop: {e}")
+
     # Pattern control methods
     def set_pattern(self, pattern_name):
         """Set the current light pattern"""
-        pattern_map = {
-            'pulse': pulse,
-            'pixel_train': pixel_train,
-            'droplets': droplets,
-            'orbits': orbits,
-            'sparks': sparks,
-            'solid': solid
-        }
-        
-        if pattern_name.lower() in pattern_map:
+        if pattern_name.lower() in PATTERNS:
             with self._lock:
-                self.function = pattern_map[pattern_name.lower()]
-                if pattern_name.lower() == 'solid':
-                    self._static_mode = True
-                else:
-                    self._static_mode = False
-                self._request_render()
+                self._update(function=PATTERNS[pattern_name.lower()],
+                             static_mode=pattern_name.lower() == 'solid')
             return True
         return False
     
     def set_brightness(self, brightness, transition=0.0):
         """Set brightness (0.0 to 1.0) with optional smooth transition"""
         brightness = max(0.0, min(1.0, float(brightness)))
-        if transition > 0 and self._running:
-            # Smooth fade in a background thread
-            threading.Thread(
-                target=self._fade_brightness,
-                args=(brightness, transition),
-                daemon=True
-            ).start()
-        else:
-            with self._lock:
-                self.brightness = brightness
-                self._request_render()
-        return brightness
-
-    def _fade_brightness(self, target, duration):
-        """Smoothly fade brightness over duration seconds"""
-        steps = max(1, int(duration * 30))  # 30 steps per second
         with self._lock:
-            start_val = self.brightness
-        for i in range(1, steps + 1):
-            if not self._running:
-                break
-            # Ease-out curve for natural feel
-            progress = i / steps
-            eased = 1.0 - (1.0 - progress) ** 2
-            val = start_val + (target - start_val) * eased
-            with self._lock:
-                self.brightness = val
-                self._request_render()
-            time.sleep(duration / steps)
-        with self._lock:
-            self.brightness = target
-            self._request_render()
+            self._start_transition('brightness', brightness, transition)
+        return brightness
     
-    def set_saturation(self, saturation):
-        """Set saturation (0.0 to 1.0)"""
+    def set_saturation(self, saturation, transition=0.0):
+        """Set saturation (0.0 to 1.0) with optional smooth transition"""
         saturation = max(0.0, min(1.0, float(saturation)))
         with self._lock:
-            self.saturation = saturation
-            self._request_render()
+            self._start_transition('saturation', saturation, transition)
         return saturation
 
-    def set_hue(self, hue):
-        """Set color hue (0-360 degrees, mapped to 0-255 color wheel)"""
+    def set_hue(self, hue, transition=0.0):
+        """Set color hue (0-360 degrees, mapped to 0-255 color wheel) with optional smooth transition"""
         hue = max(0, min(360, float(hue)))
-        wheel_value = int(hue * 255 / 360)
+        wheel_value = round(hue * 255 / 360)
         with self._lock:
-            self.hue = wheel_value
-            self._request_render()
+            self._start_transition('hue', wheel_value, transition)
         return hue
     
-    def set_speed(self, speed_factor):
-        """Set speed multiplier"""
+    def set_speed(self, speed_factor, transition=0.0):
+        """Set speed multiplier with optional smooth transition"""
         speed_factor = max(0.1, min(8.0, float(speed_factor)))
         with self._lock:
-            self.speed_factor = speed_factor
+            self._start_transition('speed_factor', speed_factor, transition)
         return speed_factor
     
-    def set_tempo(self, bpm):
-        """Set tempo in beats per minute"""
+    def set_tempo(self, bpm, transition=0.0):
+        """Set tempo in beats per minute with optional smooth transition"""
         bpm = max(30, min(300, int(bpm)))
-        cycle_time = 60000 / bpm  # Convert BPM to milliseconds per cycle
         with self._lock:
-            self.tempo = bpm
-            self.cycle_time = cycle_time
+            self._start_transition('tempo', bpm, transition)
         return bpm
     
     def toggle_alt_mode(self):
         """Toggle alternate mode"""
         with self._lock:
-            self.alt = not self.alt
-        return self.alt
+            alt = not self._params.alt
+            self._update(alt=alt)
+        return alt
     
     def sync_phase(self):
         """Sync the phase (restart timing)"""
@@ -331,157 +643,306 @@ class HeadlessController:
     
     def set_mute(self, mute_enabled, mute_type='instant'):
         """Set mute state and type"""
-        from mute import fade_in, fade_out
-        mute_map = {
-            'instant': instant,
-            'gradual': gradual,
-            'flicker': flicker,
-            'fade_out': fade_out,
-            'fade_in': fade_in
-        }
-        
-        if mute_type.lower() in mute_map:
+        if mute_type.lower() in MUTE_TYPES:
             with self._lock:
-                self.mute = bool(mute_enabled)
-                self.mute_fn = mute_map[mute_type.lower()]
-                if self.mute and not self.mute_start:
-                    self.mute_start = time.time()
-                elif not self.mute:
-                    self.mute_start = None
-                self._request_render()
+                self._apply_changes({'mute': bool(mute_enabled),
+                                     'mute_fn': MUTE_TYPES[mute_type.lower()]})
             return True
         return False
     
     def set_all_atomic(self, pattern=None, brightness=None, saturation=None, hue=None, mute=None):
-        """Set multiple parameters atomically without intermediate rendering"""
-        with self._lock:
-            # Pause rendering during the update
-            self._updating = True
-            
-            try:
-                # Set all parameters
-                if pattern is not None:
-                    pattern_map = {
-                        'pulse': pulse,
-                        'pixel_train': pixel_train,
-                        'droplets': droplets,
-                        'orbits': orbits,
-                        'sparks': sparks,
-                        'solid': solid
-                    }
-                    if pattern.lower() in pattern_map:
-                        self.function = pattern_map[pattern.lower()]
-                        if pattern.lower() == 'solid':
-                            self._static_mode = True
-                        else:
-                            self._static_mode = False
-                
-                if brightness is not None:
-                    self.brightness = max(0.0, min(1.0, float(brightness)))
-                    
-                if saturation is not None:
-                    self.saturation = max(0.0, min(1.0, float(saturation)))
-                    
-                if hue is not None:
-                    hue_val = max(0, min(360, float(hue)))
-                    self.hue = int(hue_val * 255 / 360)
-                    
-                if mute is not None:
-                    self.mute = bool(mute)
-                    if self.mute and not self.mute_start:
-                        self.mute_start = time.time()
-                    elif not self.mute:
-                        self.mute_start = None
-                        
-                # Short delay to ensure any in-progress frame completes
-                time.sleep(0.02)
-
-            finally:
-                # Resume rendering and request a new frame
-                self._updating = False
-                self._request_render()
-                
-        return True
+        """Set multiple parameters atomically without intermediate rendering.
+        Returns the frame number the changes took effect at, or None on timeout"""
+        changes = {}
+        if pattern is not None:
+            if pattern.lower() in PATTERNS:
+                changes['function'] = PATTERNS[pattern.lower()]
+                changes['static_mode'] = pattern.lower() == 'solid'
+
+        if brightness is not None:
+            changes['brightness'] = max(0.0, min(1.0, float(brightness)))
+
+        if saturation is not None:
+            changes['saturation'] = max(0.0, min(1.0, float(saturation)))
+
+        if hue is not None:
+            hue_val = max(0, min(360, float(hue)))
+            changes['hue'] = round(hue_val * 255 / 360)
+
+        if mute is not None:
+            changes['mute'] = bool(mute)
+
+        return self.commit(changes)
+
+    def restore(self, status):
+        """Apply saved settings, in the format of get_status(), as one snapshot.
+        Called before start() the first frame already shows them, with no
+        transitions and any saved mute already complete. Returns the names
+        of the settings restored"""
+        changes = {}
+        restored = []
+        pattern = str(status.get('pattern', '')).lower()
+        if pattern in PATTERNS:
+            changes['function'] = PATTERNS[pattern]
+            changes['static_mode'] = pattern == 'solid'
+            restored.append('pattern')
+        if 'brightness' in status:
+            changes['brightness'] = max(0.0, min(1.0, float(status['brightness'])))
+            restored.append('brightness')
+        if 'saturation' in status:
+            changes['saturation'] = max(0.0, min(1.0, float(status['saturation'])))
+            restored.append('saturation')
+        if 'hue' in status:
+            changes['hue'] = round(max(0, min(360, float(status['hue']))) * 255 / 360)
+            restored.append('hue')
+        if 'speed_factor' in status:
+            changes['speed_factor'] = max(0.1, min(8.0, float(status['speed_factor'])))
+            restored.append('speed_factor')
+        if 'tempo' in status:
+            changes['tempo'] = max(30, min(300, int(status['tempo'])))
+            changes['cycle_time'] = 60000 / changes['tempo']
+            restored.append('tempo')
+        if 'alt_mode' in status:
+            changes['alt'] = bool(status['alt_mode'])
+            restored.append('alt_mode')
+        if 'mute' in status:
+            mute_type = str(status.get('mute_type', '')).lower()
+            if mute_type in MUTE_TYPES:
+                changes['mute_fn'] = MUTE_TYPES[mute_type]
+            changes['mute'] = bool(status['mute'])
+            # Start the mute clock far enough back that it has already run its course
+            changes['mute_start'] = (self._clock() - max(SILENT_AFTER.values()) / 1000.0
+                                     if changes['mute'] else None)
+            restored.append('mute')
+        changes['transitions'] = {}
+        changes['sunrise'] = None
+
+        self.commit(changes)
+        return restored
     
     def start_sunrise(self, duration_minutes=30, end_brightness=0.8,
                        start_hue=20, end_hue=40,
                        start_saturation=0.6, end_saturation=0.05):
         """Start a sunrise fade-in over the given duration"""
+        sunrise = Sunrise(
+            start_time=self._clock(),
+            duration=duration_minutes * 60,
+            start_brightness=0.0,
+            end_brightness=max(0.0, min(1.0, float(end_brightness))),
+            start_hue=float(start_hue),
+            end_hue=float(end_hue),
+            start_saturation=float(start_saturation),
+            end_saturation=float(end_saturation)
+        )
         with self._lock:
-            self._sunrise_duration = duration_minutes * 60
-            self._sunrise_start_brightness = 0.0
-            self._sunrise_end_brightness = max(0.0, min(1.0, float(end_brightness)))
-            self._sunrise_start_hue = float(start_hue)
-            self._sunrise_end_hue = float(end_hue)
-            self._sunrise_start_saturation = float(start_saturation)
-            self._sunrise_end_saturation = float(end_saturation)
-
-            # Set initial state
-            self.brightness = 0.0
-            self.hue = int(start_hue * 255 / 360)
-            self.saturation = start_saturation
-            self.mute = False
-            self.mute_start = None
-
-            # Activate
-            self._sunrise_start_time = time.time()
-            self._sunrise_active = True
-            self._request_render()
+            # Set initial state and activate
+            transitions = {name: transition for name, transition in self._params.transitions.items()
+                           if name not in ('brightness', 'hue', 'saturation')}
+            self._update(transitions=transitions,
+                         brightness=0.0,
+                         hue=int(start_hue * 255 / 360),
+                         saturation=start_saturation,
+                         mute=False,
+                         mute_start=None,
+                         sunrise=sunrise)
         return True
 
     def stop_sunrise(self):
         """Cancel sunrise, keep current brightness"""
         with self._lock:
-            self._sunrise_active = False
+            sunrise = self._params.sunrise
+            if sunrise is not None:
+                _, brightness, hue, saturation = sunrise_values(sunrise, self._clock())
+                self._update(brightness=brightness, hue=hue, saturation=saturation, sunrise=None)
         return True
 
     def get_sunrise_status(self):
         """Get sunrise progress"""
+        sunrise = self._params.sunrise
+        if sunrise is None:
+            return {'active': False}
+        now = self._clock()
+        elapsed = now - sunrise.start_time
+        progress, brightness, _, _ = sunrise_values(sunrise, now)
+        remaining = max(0, sunrise.duration - elapsed)
+        return {
+            'active': True,
+            'progress': round(progress, 4),
+            'progress_percent': round(progress * 100, 1),
+            'elapsed_seconds': round(elapsed, 1),
+            'remaining_seconds': round(remaining, 1),
+            'remaining_minutes': round(remaining / 60, 1),
+            'current_brightness': round(brightness, 3),
+        }
+
+    def set_target_fps(self, target_fps):
+        """Set the target frame rate of the render loop"""
         with self._lock:
-            if not self._sunrise_active or not self._sunrise_start_time:
-                return {'active': False}
-            elapsed = time.time() - self._sunrise_start_time
-            progress = min(1.0, elapsed / self._sunrise_duration)
-            remaining = max(0, self._sunrise_duration - elapsed)
-            return {
-                'active': True,
-                'progress': round(progress, 4),
-                'progress_percent': round(progress * 100, 1),
-                'elapsed_seconds': round(elapsed, 1),
-                'remaining_seconds': round(remaining, 1),
-                'remaining_minutes': round(remaining / 60, 1),
-                'current_brightness': round(self.brightness, 3),
-            }
-
-    def get_status(self):
-        """Get current controller status"""
+            return self._scheduler.set_target_fps(target_fps)
+
+    def get_frame_stats(self):
+        """Get frame pacing and output stats"""
+        stats = {
+            **self._scheduler.get_stats(),
+            'frames_written': self.frames_written,
+            'frames_skipped': self.frames_skipped,
+            'first_frame_ms': self.first_frame_ms
+        }
+        if self._loop_cache is not None:
+            stats['loop_cache'] = self._loop_cache.get_stats()
+        if self._output_frames is not None:
+            # Frames rendered faster than the output could take them
+            stats['frames_dropped_output'] = self._output_frames.dropped
+        if self._strips is not None:
+            stats['strips'] = self._strips.get_stats()
+        return stats
+
+    def profile(self, seconds, mode='cprofile'):
+        """Profile the render thread for seconds. mode 'cprofile' returns the
+        top functions by cumulative time as pstats text, 'sample' returns
+        collapsed stacks for flamegraphs. Returns None if the loop is not
+        running or another profile is in progress"""
+        thread = self._thread
+        if not self._running or thread is None:
+            return None
+
+        if mode == 'sample':
+            return sample_thread(thread.ident, seconds)
+
+        request = {'profiler': None, 'stop': False, 'report': None, 'done': threading.Event()}
         with self._lock:
-            # Get pattern name
-            pattern_name = 'unknown'
-            for name, func in [('pulse', pulse), ('pixel_train', pixel_train), 
-                             ('droplets', droplets), ('orbits', orbits), ('sparks', sparks), ('solid', solid)]:
-                if self.function == func:
-                    pattern_name = name
-                    break
-            
-            # Get mute function name  
-            mute_name = 'unknown'
-            for name, func in [('instant', instant), ('gradual', gradual), ('flicker', flicker)]:
-                if self.mute_fn == func:
-                    mute_name = name
-                    break
-            
-            return {
-                'running': self._running,
-                'pattern': pattern_name,
-                'brightness': self.brightness,
-                'saturation': self.saturation,
-                'hue': int(self.hue * 360 / 255),  # Convert back to 0-360 degrees
-                'speed_factor': self.speed_factor,
-                'tempo': self.tempo,
-                'alt_mode': self.alt,
-                'mute': self.mute,
-                'mute_type': mute_name,
-                'output_mode': self.output,
-                'n_pixels': self.n_pix
-            }
\ No newline at end of file
+            if self._profile_request is not None:
+                return None
+            self._profile_request = request
+        self._wake_event.set()
+
+        time.sleep(seconds)
+        request['stop'] = True
+        self._wake_event.set()
+        if not request['done'].wait(timeout=5.0) and not thread.is_alive():
+            # Loop has died, nothing will pick the request up. A stuck loop
+            # keeps it so the profiler is still stopped once it moves again
+            self._profile_request = None
+        return request['report']
+
+    def get_metrics(self):
+        """Get stage timings and loop counters in Prometheus text format"""
+        return self._metrics.render_prometheus({
+            'lights_frames_rendered_total': ('Frames rendered by the loop',
+                                             self.frame_number - self.frames_rendered_offline),
+            'lights_frames_rendered_offline_total': ('Frames rendered by render_frame, outside the loop',
+                                                     self.frames_rendered_offline),
+            'lights_frames_written_total': ('Frames pushed to the output', self.frames_written),
+            'lights_frames_skipped_total': ('Frames identical to the last one written, not pushed',
+                                            self.frames_skipped),
+            'lights_deadline_overruns_total': ('Frame deadlines missed because a frame ran late',
+                                               self._scheduler.frames_dropped),
+        }, strips=self._strips.timings if self._strips is not None else None)
+
+    def get_status(self, targets=False):
+        """Get current controller status. With targets, parameters that are
+        transitioning report the value they are heading to"""
+        params = self._params
+        if targets and params.transitions:
+            settled = {name: transition.target for name, transition in params.transitions.items()}
+            params = params._replace(transitions={}, **settled)
+        values, _ = current_values(params, self._clock())
+
+        # Get pattern name
+        pattern_name = 'unknown'
+        for name, func in PATTERNS.items():
+            if params.function == func:
+                pattern_name = name
+                break
+        
+        # Get mute function name  
+        mute_name = 'unknown'
+        for name, func in MUTE_TYPES.items():
+            if params.mute_fn == func:
+                mute_name = name
+                break
+        
+        return {
+            'running': self._running,
+            'pattern': pattern_name,
+            'brightness': values['brightness'],
+            'saturation': values['saturation'],
+            'hue': round(values['hue'] * 360 / 255),  # Convert back to 0-360 degrees
+            'speed_factor': values['speed_factor'],
+            'tempo': values['tempo'],
+            'alt_mode': params.alt,
+            'mute': params.mute,
+            'mute_type': mute_name,
+            'output_mode': self.output,
+            'n_pixels': self.n_pix
+        }
+
+    # Read-only views of the current parameter snapshot, e.g. controller.brightness
+
+    @property
+    def version(self):
+        return self._params.version
+
+    @property
+    def function(self):
+        return self._params.function
+
+    @property
+    def brightness(self):
+        return self._params.brightness
+
+    @property
+    def saturation(self):
+        return self._params.saturation
+
+    @property
+    def hue(self):
+        return self._params.hue
+
+    @property
+    def speed_factor(self):
+        return self._params.speed_factor
+
+    @property
+    def tempo(self):
+        return self._params.tempo
+
+    @property
+    def cycle_time(self):
+        return self._params.cycle_time
+
+    @property
+    def alt(self):
+        return self._params.alt
+
+    @property
+    def warm_shift(self):
+        return self._params.warm_shift
+
+    @property
+    def warm_rgb(self):
+        return self._params.warm_rgb
+
+    @property
+    def mute(self):
+        return self._params.mute
+
+    @property
+    def mute_fn(self):
+        return self._params.mute_fn
+
+    @property
+    def mute_start(self):
+        return self._params.mute_start
+
+    @property
+    def static_mode(self):
+        return self._params.static_mode
+
+    @property
+    def sunrise(self):
+        return self._params.sunrise
+
+    @property
+    def transitions(self):
+        return self._params.transitions
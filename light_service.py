@@ -1,16 +1,20 @@
 """ Thread-safe light service wrapper for API operations """
 
 import threading
-import time
 import atexit
 from headless_controller import HeadlessController
+from profiler import MODES
 
 
 class APILightService:
     """ Thread-safe wrapper for light operations that can be controlled via API """
     
-    def __init__(self, use_lights=True, n_pixels=50, show_animation=False):
-        self.controller = HeadlessController(use_lights=use_lights, n_pixels=n_pixels, show_animation=show_animation)
+    def __init__(self, use_lights=True, n_pixels=50, show_animation=False, target_fps=60,
+                 loop_cache_mb=0, pipelined=False, strip_configs=None, spi_factory=None):
+        self.controller = HeadlessController(use_lights=use_lights, n_pixels=n_pixels,
+                                             show_animation=show_animation, target_fps=target_fps,
+                                             loop_cache_mb=loop_cache_mb, pipelined=pipelined,
+                                             strip_configs=strip_configs, spi_factory=spi_factory)
         self._lock = threading.RLock()
         self._initialized = False
         
@@ -24,8 +28,8 @@ class APILightService:
                 success = self.controller.start()
                 if success:
                     self._initialized = True
-                    # Give the controller a moment to start up
-                    time.sleep(0.1)
+                    # Return once the first frame is out, rather than before
+                    self.controller.wait_for_first_frame(timeout=1.0)
                 return success
             return True
     
@@ -88,11 +92,12 @@ class APILightService:
                 'brightness_percent': int(brightness * 100)
             }
     
-    def set_saturation(self, saturation):
+    def set_saturation(self, saturation, transition=0.0):
         """Set color saturation
         
         Args:
             saturation (float): Saturation level (0.0 to 1.0) or (0 to 100 for percentage)
+            transition (float): Transition time in seconds (default 0, instant)
             
         Returns:
             dict: Result with success status and actual saturation value
@@ -105,7 +110,7 @@ class APILightService:
             if saturation > 1.0:
                 saturation = saturation / 100.0
             
-            actual_saturation = self.controller.set_saturation(saturation)
+            actual_saturation = self.controller.set_saturation(saturation, transition=transition)
             return {
                 'success': True,
                 'message': f'Saturation set to {int(actual_saturation * 100)}%',
@@ -113,11 +118,12 @@ class APILightService:
                 'saturation_percent': int(actual_saturation * 100)
             }
     
-    def set_hue(self, hue):
+    def set_hue(self, hue, transition=0.0):
         """Set color hue
         
         Args:
             hue (float): Hue value (0-360 degrees)
+            transition (float): Transition time in seconds (default 0, instant)
             
         Returns:
             dict: Result with success status and actual hue value
@@ -126,7 +132,7 @@ class APILightService:
             if not self._initialized:
                 return {'success': False, 'message': 'Service not initialized'}
             
-            actual_hue = self.controller.set_hue(hue)
+            actual_hue = self.controller.set_hue(hue, transition=transition)
             return {
                 'success': True,
                 'message': f'Hue set to {int(actual_hue)}°',
@@ -134,11 +140,12 @@ class APILightService:
                 'hue_degrees': int(actual_hue)
             }
     
-    def set_speed(self, speed_factor):
+    def set_speed(self, speed_factor, transition=0.0):
         """Set animation speed multiplier
         
         Args:
             speed_factor (float): Speed multiplier (0.1 to 8.0)
+            transition (float): Transition time in seconds (default 0, instant)
             
         Returns:
             dict: Result with success status and actual speed value
@@ -147,18 +154,19 @@ class APILightService:
             if not self._initialized:
                 return {'success': False, 'message': 'Service not initialized'}
             
-            actual_speed = self.controller.set_speed(speed_factor)
+            actual_speed = self.controller.set_speed(speed_factor, transition=transition)
             return {
                 'success': True,
                 'message': f'Speed set to {actual_speed}x',
                 'speed_factor': actual_speed
             }
     
-    def set_tempo(self, bpm):
+    def set_tempo(self, bpm, transition=0.0):
         """Set tempo in beats per minute
         
         Args:
             bpm (int): Beats per minute (30 to 300)
+            transition (float): Transition time in seconds (default 0, instant)
             
         Returns:
             dict: Result with success status and actual tempo value
@@ -166,7 +174,7 @@ class APILightService:
         if not self._initialized:
             return {'success': False, 'message': 'Service not initialized'}
         
-        actual_tempo = self.controller.set_tempo(bpm)
+        actual_tempo = self.controller.set_tempo(bpm, transition=transition)
         return {
             'success': True,
             'message': f'Tempo set to {actual_tempo} BPM',
@@ -229,13 +237,17 @@ class APILightService:
             else:
                 return {'success': False, 'message': f'Invalid mute type: {mute_type}'}
     
-    def get_status(self):
+    def get_status(self, targets=False):
         """Get comprehensive service and controller status
         
+        Args:
+            targets (bool): Report where running transitions are heading
+                rather than their current values
+        
         Returns:
             dict: Complete status information
         """
-        controller_status = self.controller.get_status() if self._initialized else {}
+        controller_status = self.controller.get_status(targets) if self._initialized else {}
         
         return {
             'service_initialized': self._initialized,
@@ -243,6 +255,61 @@ class APILightService:
             **controller_status
         }
     
+    def wait_for_change(self, version, timeout=None):
+        """Wait for the controller settings to change
+        
+        Args:
+            version (int): Last settings version seen, None to return at once
+            timeout (float): Seconds to wait at most
+            
+        Returns:
+            int: Current settings version
+        """
+        return self.controller.wait_for_change(version, timeout)
+    
+    def get_frame_stats(self):
+        """Get render loop frame rate, jitter and output stats
+        
+        Returns:
+            dict: Result with success status and frame stats
+        """
+        if not self._initialized:
+            return {'success': False, 'message': 'Service not initialized'}
+        
+        return {'success': True, **self.controller.get_frame_stats()}
+
+    def profile(self, seconds=5, mode='cprofile'):
+        """Profile the render thread
+        
+        Args:
+            seconds (float): How long to profile for (1 to 60)
+            mode (str): 'cprofile' for pstats text, 'sample' for collapsed stacks
+            
+        Returns:
+            dict: Result with success status and the profile report
+        """
+        if not self._initialized:
+            return {'success': False, 'message': 'Service not initialized'}
+        if mode not in MODES:
+            return {'success': False, 'message': f'Invalid profile mode: {mode}'}
+        
+        seconds = max(1.0, min(60.0, float(seconds)))
+        report = self.controller.profile(seconds, mode)
+        if report is None:
+            return {'success': False, 'message': 'Render loop is not running or already being profiled'}
+        return {'success': True, 'message': f'Profiled render loop for {seconds:g}s', 'report': report}
+
+    def get_metrics(self):
+        """Get render loop stage timings and counters
+        
+        Returns:
+            str: Metrics in Prometheus text format, None if not initialized
+        """
+        if not self._initialized:
+            return None
+        
+        return self.controller.get_metrics()
+    
     def get_available_patterns(self):
         """Get list of available light patterns
         
@@ -284,7 +351,7 @@ class APILightService:
             saturation = saturation / 100.0
             
         # Use the controller's atomic update method
-        success = self.controller.set_all_atomic(
+        frame = self.controller.set_all_atomic(
             pattern=pattern,
             brightness=brightness, 
             saturation=saturation,
@@ -304,12 +371,36 @@ class APILightService:
         if mute is not None:
             results.append(f'Mute: {mute}')
         
+        if frame is None:
+            return {
+                'success': False,
+                'message': 'Render loop did not apply the settings in time',
+                'details': results
+            }
         return {
-            'success': success,
-            'message': 'All settings applied atomically (with rendering pause)',
+            'success': True,
+            'message': f'All settings applied atomically at frame {frame}',
+            'frame': frame,
             'details': results
         }
 
+    def restore_state(self, state):
+        """Apply saved settings as one snapshot. Call before initialize()
+        so the first frame already shows them
+        
+        Args:
+            state (dict): Settings in the format of get_status()
+            
+        Returns:
+            dict: Result with success status and the settings restored
+        """
+        restored = self.controller.restore(state)
+        return {
+            'success': bool(restored),
+            'message': f'Restored {len(restored)} settings',
+            'restored': restored
+        }
+
     def start_sunrise(self, duration_minutes=30, end_brightness=0.8,
                        start_hue=20, end_hue=40,
                        start_saturation=0.6, end_saturation=0.05,
@@ -377,13 +468,19 @@ _light_service = None
 _service_lock = threading.Lock()
 
 
-def get_light_service(use_lights=True, n_pixels=50, show_animation=False):
+def get_light_service(use_lights=True, n_pixels=50, show_animation=False, target_fps=60,
+                      loop_cache_mb=0, pipelined=False, strip_configs=None, spi_factory=None):
     """Get the global light service instance (singleton pattern)
     
     Args:
         use_lights (bool): Whether to control actual lights or use animation
         n_pixels (int): Number of pixels if using animation mode
         show_animation (bool): Whether to show pygame animation when use_lights=False
+        target_fps (float): Frame rate the render loop aims for
+        loop_cache_mb (float): Memory budget for precomputed pattern cycles, 0 to disable
+        pipelined (bool): Render the next frame while the current one is written out
+        strip_configs (list): StripConfigs to drive several strips as one, None for a single strip
+        spi_factory (callable): Opens the SPI device for (port, device), None for real hardware
         
     Returns:
         APILightService: The global service instance
@@ -392,5 +489,8 @@ def get_light_service(use_lights=True, n_pixels=50, show_animation=False):
     
     with _service_lock:
         if _light_service is None:
-            _light_service = APILightService(use_lights=use_lights, n_pixels=n_pixels, show_animation=show_animation)
+            _light_service = APILightService(use_lights=use_lights, n_pixels=n_pixels,
+                                             show_animation=show_animation, target_fps=target_fps,
+                                             loop_cache_mb=loop_cache_mb, pipelined=pipelined,
+                                             strip_configs=strip_configs, spi_factory=spi_factory)
         return _light_service
\ No newline at end of file
@@ -0,0 +1,67 @@
+""" Contains the LoopCache class which stores one full cycle
+of a pure function of phase, sampled at a fixed resolution, so
+patterns can look values up by phase instead of recomputing
+them every frame """
+
+from collections import OrderedDict
+import numpy as np
+from frames import PATTERN_DTYPE
+
+
+class LoopCache:
+    """ LRU store of precomputed cycles, capped by a memory budget """
+
+    def __init__(self, budget_bytes=16 * 1024 * 1024, resolution=256):
+        self.budget_bytes = budget_bytes
+        self.resolution = resolution
+        self.hits = 0
+        self.misses = 0
+        self._tables = OrderedDict()
+        self._nbytes = 0
+
+    def lookup(self, key, phase, render):
+        """Get render(phase) for the cycle identified by key.
+        key must change whenever anything render depends on other
+        than phase does. Phase is rounded down to the resolution.
+        Cycles too big for the budget are rendered directly"""
+        table = self._tables.get(key)
+        if table is None:
+            self.misses += 1
+            table = self._build(key, render)
+            if table is None:
+                return render(phase)
+        else:
+            self.hits += 1
+            self._tables.move_to_end(key)
+        return table[int(phase * self.resolution) % self.resolution]
+
+    def _build(self, key, render):
+        first = np.asarray(render(0.))
+        nbytes = first.size * np.dtype(PATTERN_DTYPE).itemsize * self.resolution
+        if nbytes > self.budget_bytes:
+            return None
+
+        # Evict least recently used cycles to make room
+        while self._tables and self._nbytes + nbytes > self.budget_bytes:
+            _, evicted = self._tables.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+
+        table = np.empty((self.resolution,) + first.shape, dtype=PATTERN_DTYPE)
+        table[0] = first
+        for step in range(1, self.resolution):
+            table[step] = render(step / self.resolution)
+        table.flags.writeable = False
+
+        self._tables[key] = table
+        self._nbytes += table.nbytes
+        return table
+
+    def get_stats(self):
+        """Get hit/miss counts and memory use"""
+        return {
+            'cycles': len(self._tables),
+            'bytes': self._nbytes,
+            'budget_bytes': self.budget_bytes,
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,80 @@
+""" Contains the FrameMetrics class which collects per stage
+timings and counters from the render loop and renders them in
+the Prometheus text exposition format. Recording is a clock read
+and a bucket increment, cheap enough to leave on all the time """
+
+from bisect import bisect_left
+
+# Upper bounds in seconds, 50us to 100ms. The frame budget at 60 fps is ~16.7ms
+STAGE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                 0.005, 0.01, 0.0167, 0.025, 0.05, 0.1)
+
+STAGES = ('render', 'dimming', 'mute', 'output', 'show')
+
+
+class Histogram:
+    """ Fixed bucket histogram. Counts are per bucket, made
+    cumulative when exported """
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _histogram_lines(name, label, histogram):
+    """Prometheus sample lines for one labelled histogram"""
+    # Copy first so a frame finishing mid export can't skew the totals
+    counts = list(histogram.counts)
+    lines = []
+    total = 0
+    for bound, count in zip(histogram.buckets, counts):
+        total += count
+        lines.append(f'{name}_bucket{{{label},le="{bound}"}} {total}')
+    total += counts[-1]
+    lines.append(f'{name}_bucket{{{label},le="+Inf"}} {total}')
+    lines.append(f'{name}_sum{{{label}}} {histogram.sum}')
+    lines.append(f'{name}_count{{{label}}} {total}')
+    return lines
+
+
+class FrameMetrics:
+    """ Stage timing histograms and counters for the render loop """
+
+    def __init__(self):
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.lock_wait_seconds = 0.0  # Time the loop spent waiting for the controller lock
+
+    def observe(self, stage, seconds):
+        """Record the time one frame spent in stage"""
+        self.stages[stage].observe(seconds)
+
+    def render_prometheus(self, counters, strips=None):
+        """Metrics as Prometheus text. counters maps metric name to
+        (help, value) and is added as counters after the histograms.
+        strips optionally maps strip name to its write time Histogram"""
+        lines = ['# HELP lights_stage_seconds Time spent in each render loop stage per frame',
+                 '# TYPE lights_stage_seconds histogram']
+        for stage, histogram in self.stages.items():
+            lines.extend(_histogram_lines('lights_stage_seconds', f'stage="{stage}"', histogram))
+
+        if strips:
+            lines.append('# HELP lights_strip_write_seconds Time to write each strip its part of a frame')
+            lines.append('# TYPE lights_strip_write_seconds histogram')
+            for strip, histogram in strips.items():
+                lines.extend(_histogram_lines('lights_strip_write_seconds', f'strip="{strip}"', histogram))
+
+        counters = dict(counters)
+        counters['lights_lock_wait_seconds_total'] = (
+            'Time the render loop spent waiting for the controller lock', self.lock_wait_seconds)
+        for name, (help_text, value) in counters.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
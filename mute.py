@@ -2,44 +2,70 @@
 takes (elapsed, kwargs) as arguments so that they
 can be used interchangably within the Controller class. 
 Each function returns a numpy array with the dimming factor
-for each rgb value of each light. """
+for each rgb value of each light, written into out when it
+is given. """
 
 import numpy as np
+from frames import PATTERN_DTYPE
+
+_rng = np.random.default_rng()
 
 DURATION = 5000
+FADE_DURATION = 1000
+
+def _filled(shape, factor, out):
+    if out is None:
+        return np.full(shape, factor, dtype=PATTERN_DTYPE)
+    out.fill(factor)
+    return out
 
-def instant(elapsed, kwargs):
+def instant(elapsed, kwargs, out=None):
     shape = kwargs["shape"]
-    return np.zeros(shape)
+    return _filled(shape, 0., out)
 
-def gradual(elapsed, kwargs, duration=DURATION):
+def gradual(elapsed, kwargs, out=None, duration=DURATION):
     shape = kwargs["shape"]
     if elapsed > duration:
-        return np.zeros(shape)
+        return _filled(shape, 0., out)
     factor = (duration - elapsed) / float(duration)
-    return np.full(shape, factor)
+    return _filled(shape, factor, out)
 
-def fade_out(elapsed, kwargs, duration=1000):
+def fade_out(elapsed, kwargs, out=None, duration=FADE_DURATION):
     """Fade out over specified duration (default 1 second)"""
     shape = kwargs["shape"]
     if elapsed > duration:
-        return np.zeros(shape)
+        return _filled(shape, 0., out)
     factor = (duration - elapsed) / float(duration)
-    return np.full(shape, factor)
+    return _filled(shape, factor, out)
 
-def fade_in(elapsed, kwargs, duration=1000):
+def fade_in(elapsed, kwargs, out=None, duration=FADE_DURATION):
     """Fade in over specified duration (default 1 second)"""
     shape = kwargs["shape"]
     if elapsed > duration:
-        return np.ones(shape)
+        return _filled(shape, 1., out)
     factor = elapsed / float(duration)
-    return np.full(shape, factor)
+    return _filled(shape, factor, out)
 
-def flicker(elapsed, kwargs, duration=DURATION):
+def flicker(elapsed, kwargs, out=None, duration=DURATION):
     shape = kwargs["shape"]
     if elapsed > duration:
-        return np.zeros(shape)
+        return _filled(shape, 0., out)
     factor = (duration - elapsed) / float(duration)
-    return np.random.binomial(1, factor, shape) * factor
+    if out is None:
+        return np.random.binomial(1, factor, shape) * factor
+    # Each value is on with probability factor, same as the binomial draw
+    _rng.random(dtype=out.dtype, out=out)
+    np.less(out, factor, out=out)
+    out *= factor
+    return out
 
+# Elapsed ms after which each mute function only returns zeros.
+# fade_in settles on ones instead, so it never goes silent
+SILENT_AFTER = {instant: 0,
+                gradual: DURATION,
+                flicker: DURATION,
+                fade_out: FADE_DURATION}
 
+def is_silent(mute_fn, elapsed):
+    """ True once mute_fn has reached zero and will stay there """
+    return mute_fn in SILENT_AFTER and elapsed >= SILENT_AFTER[mute_fn]
@@ -2,15 +2,41 @@
 takes (phase, cache, kwargs) as arguments so that they
 can be used interchangably within the Controller class.
 Each function returns a numpy array with the rgb values
-for each light. """
+for each light. Passing a PATTERN_DTYPE array of the frame shape
+as out renders into it in place, so the render loop can reuse
+the same buffer every frame. """
 
+from functools import lru_cache
 import numpy as np
-from colors import wheel, shift
+from colors import wheel, wheel_array, wheel_table, shift
+from frames import PATTERN_DTYPE, pattern_buffer
 import random
 from phase import modify_phase
-import time
 
-def pixel_train(phase, cache, kwargs, step=2.5, dim_factor=0.92):
+# Random pulse offsets per pixel count. Kept rather than redrawn so that
+# coming back to pulse plays the same wave and reuses its cached cycles
+_alt_offsets = {}
+
+def _pulse_offset(n_pix, alt):
+    if not alt:
+        return np.zeros(n_pix, dtype=PATTERN_DTYPE)
+    if n_pix not in _alt_offsets:
+        offset = np.random.randn(n_pix).astype(PATTERN_DTYPE)
+        offset.flags.writeable = False  # Shared between caches
+        _alt_offsets[n_pix] = offset
+    return _alt_offsets[n_pix]
+
+def _pulse_cycle_key(alt, offset):
+    # Everything the wave depends on besides phase and floor. bytes
+    # caches its hash, so this is cheap to look up every frame
+    return ("pulse", alt, offset.tobytes())
+
+def _out_buffer(out, shape):
+    if out is None:
+        return pattern_buffer(shape)
+    return out
+
+def pixel_train(phase, cache, kwargs, out=None, step=2.5, dim_factor=0.92):
 
     shape = kwargs["shape"]
     n_pix = shape[0]
@@ -23,9 +49,10 @@ def pixel_train(phase, cache, kwargs, step=2.5, dim_factor=0.92):
     # Initialize new cache
     if cache.get("mode") != "pixel_train":
         cache = {"mode":"pixel_train",
-                 "rgb_values": np.zeros(shape),
+                 "rgb_values": pattern_buffer(shape),
                  "pix_idx": 0,
-                 "wheel_color": 0
+                 "wheel_color": 0,
+                 "color": pattern_buffer(3)
                  }
 
     rgb_values = cache["rgb_values"]
@@ -42,21 +69,23 @@ def pixel_train(phase, cache, kwargs, step=2.5, dim_factor=0.92):
         curr_pix = n_pix - curr_pix - 1
     if curr_pix != pix_idx:
         wheel_color = int((wheel_color + step) % 255)
-        rgb = wheel(wheel_color, True, saturation)
-        rgb_values = rgb_values * dim_factor
+        rgb = wheel_table(saturation)[wheel_color]
+        rgb_values *= dim_factor
         if warm_shift:
-            rgb = shift(rgb, warm_rgb, 1. - saturation)
+            rgb = shift(rgb, warm_rgb, 1. - saturation, out=cache["color"])
         rgb_values[curr_pix] = rgb
 
 
     # Save new values in cache
-    cache["rgb_values"] = rgb_values
     cache["pix_idx"] = curr_pix
     cache["wheel_color"] = wheel_color
-    return rgb_values, cache
 
+    out = _out_buffer(out, shape)
+    np.copyto(out, rgb_values)
+    return out, cache
 
-def pulse(phase, cache, kwargs, floor=0.2, color_step=0.1, color_range=5):
+
+def pulse(phase, cache, kwargs, out=None, floor=0.2, color_step=0.1, color_range=5):
 
     warm_shift = kwargs["warm_shift"]
     warm_rgb = kwargs["warm_rgb"]
@@ -70,42 +99,39 @@ def pulse(phase, cache, kwargs, floor=0.2, color_step=0.1, color_range=5):
         cache = {"mode": "pulse",
                  "wheel_idx": 0,
                  "old_alt": alt}
-        if alt:
-            cache["offset"] = np.random.randn(n_pix)
-        else:
-            cache["offset"] = np.zeros(n_pix)
-        cache["color_offset"] = np.random.randint(-color_range, color_range, size=(n_pix, 3))
+        cache["offset"] = _pulse_offset(n_pix, alt)
+        cache["cycle_key"] = _pulse_cycle_key(alt, cache["offset"])
+        # Stored in the frame dtype so adding it needs no cast
+        cache["color_offset"] = np.random.randint(-color_range, color_range, size=(n_pix, 3)).astype(PATTERN_DTYPE)
+        cache["wave"] = pattern_buffer((n_pix, 1))
+        cache["color"] = pattern_buffer(3)
 
     color_offset = cache["color_offset"]
     wheel_idx = (cache["wheel_idx"] + color_step) % 256
     old_alt = cache["old_alt"]
     if alt != old_alt:
-        if alt:
-            cache["offset"] = np.random.randn(n_pix)
-        else:
-            cache["offset"] = np.zeros(n_pix)
+        cache["offset"] = _pulse_offset(n_pix, alt)
+        cache["cycle_key"] = _pulse_cycle_key(alt, cache["offset"])
 
     offset = cache["offset"]
 
+    # The wave only depends on phase for a given offset,
+    # so it can be played back from a precomputed cycle
+    loop_cache = kwargs.get("loop_cache")
+    if loop_cache is not None:
+        wave = loop_cache.lookup(cache["cycle_key"] + (floor,), phase,
+                                 lambda p: pulse_wave(offset, p, floor))
+    else:
+        wave = pulse_wave(offset, phase, floor, out=cache["wave"])
 
-    # Phase in radians, shifted so it
-    # starts at the peak
-    phase_rad = 2 * np.pi * np.expand_dims(offset + phase, 1)
-    phase_rad += 0.5 * np.pi
-
-    sin_phase = np.sin(phase_rad)
-    sin_squashed = (sin_phase + 1) / 2
-    sin_floored = floor + ((1-floor) * sin_squashed)
-
-    rgb = wheel(int(wheel_idx), True, saturation)
+    rgb = wheel_table(saturation)[int(wheel_idx)]
     if warm_shift:
-        rgb = shift(rgb, warm_rgb, 1. - saturation)
-    rgb_values = np.zeros(shape)
+        rgb = shift(rgb, warm_rgb, 1. - saturation, out=cache["color"])
+    rgb_values = _out_buffer(out, shape)
     rgb_values[:] = rgb
     rgb_values += color_offset
-    rgb_values = np.maximum(rgb_values, 0)
-    rgb_values = np.minimum(rgb_values, 255)
-    rgb_values = rgb_values * sin_floored
+    np.clip(rgb_values, 0, 255, out=rgb_values)
+    rgb_values *= wave
 
     cache["wheel_idx"] = wheel_idx
     cache["old_alt"] = alt
@@ -113,7 +139,27 @@ def pulse(phase, cache, kwargs, floor=0.2, color_step=0.1, color_range=5):
 
     return rgb_values, cache
 
-def droplets(phase, cache, kwargs):
+def pulse_wave(offset, phase, floor, out=None):
+    """ Brightness of each pixel in pulse, a sine between
+    floor and 1, as an (n_pix, 1) column """
+    if out is None:
+        out = pattern_buffer((len(offset), 1))
+
+    # Phase in radians, shifted so it
+    # starts at the peak
+    np.add(np.expand_dims(offset, 1), phase, out=out)
+    out *= 2 * np.pi
+    out += 0.5 * np.pi
+
+    # Sine squashed into floor - 1
+    np.sin(out, out=out)
+    out += 1
+    out /= 2
+    out *= 1 - floor
+    out += floor
+    return out
+
+def droplets(phase, cache, kwargs, out=None):
 
     # Get var from kwargs
     curr_cycle = kwargs["n_cycles"]
@@ -132,14 +178,17 @@ def droplets(phase, cache, kwargs):
                  "last_cycle":0,
                  "center_pix": random.randint(radius, n_pix - radius - 1),
                  "rgb": wheel(random.randint(0, 255), True, saturation),
-                 "last_phase":0.}
+                 "last_phase":0.,
+                 "drop": pattern_buffer((2 * radius + 1, 1)),
+                 "color": pattern_buffer(3)}
 
     center_pix = cache["center_pix"]
     last_cycle = cache["last_cycle"]
     last_phase = cache["last_phase"]
     rgb = cache["rgb"]
 
-    rgb_values = np.zeros(shape)
+    rgb_values = _out_buffer(out, shape)
+    rgb_values.fill(0)
 
     # So that drops are biggest at beginning of phase
     phase = (phase + 0.5) % 1
@@ -159,15 +208,21 @@ def droplets(phase, cache, kwargs):
     if curr_cycle != last_cycle:
         center_pix = random.randint(radius, n_pix - radius - 1)
 
-    drop_shape = calculate_drop(phase, radius)
+    loop_cache = kwargs.get("loop_cache")
+    if loop_cache is not None:
+        drop_shape = loop_cache.lookup(("droplets", radius), phase,
+                                       lambda p: calculate_drop(p, radius))
+    else:
+        drop_shape = calculate_drop(phase, radius, out=cache["drop"])
     d_start = center_pix - radius
     d_end = center_pix + radius
     if warm_shift:
-        final_rgb = shift(rgb, warm_rgb, 1. - saturation)
+        final_rgb = shift(rgb, warm_rgb, 1. - saturation, out=cache["color"])
     else:
         final_rgb = rgb
-    rgb_values[d_start: d_end + 1] = final_rgb
-    rgb_values[d_start: d_end + 1] = rgb_values[d_start: d_end + 1] * drop_shape
+    drop = rgb_values[d_start: d_end + 1]
+    drop[:] = final_rgb
+    drop *= drop_shape
 
     cache["rgb"] = rgb
     cache["last_cycle"] = curr_cycle
@@ -176,20 +231,29 @@ def droplets(phase, cache, kwargs):
 
     return rgb_values, cache
 
-def calculate_drop(phase, radius, transform="linear"):
+@lru_cache(maxsize=8)
+def drop_offsets(radius):
+    """ Distance of each pixel in a drop from its center,
+    as a (2 * radius + 1, 1) column from -1 to 0 to -1 """
+    pixels_offset = -np.abs(np.linspace(1, -1,  2 * radius + 1))
+    pixels_offset = np.expand_dims(pixels_offset, 1)
+    pixels_offset.flags.writeable = False
+    return pixels_offset
+
+def calculate_drop(phase, radius, transform="linear", out=None):
     if transform == "sin":
         phase_rads = phase * 2 * np.pi
         phase_rads -= (np.pi / 4)         # so that pixels start off
         phase = (np.sin(phase_rads) + 1) / 2
     elif transform == "linear":
         phase = -np.abs(phase * 2 - 1) + 1
-    diam = 2 * radius + 1
-    pixels_offset = -np.abs(np.linspace(1, -1,  2 * radius + 1))
-    pixels_phased = np.maximum(pixels_offset + phase, 0)
+    pixels_offset = drop_offsets(radius)
+    if out is None:
+        return np.maximum(pixels_offset + phase, 0)
+    np.add(pixels_offset, phase, out=out)
+    return np.maximum(out, 0, out=out)
 
-    return np.expand_dims(pixels_phased, 1)
-
-def orbits(phase, cache, kwargs, dim_factor=0.8, margin=70):
+def orbits(phase, cache, kwargs, out=None, dim_factor=0.8, margin=70):
     
     shape = kwargs["shape"]
     n_pix = shape[0]
@@ -202,8 +266,10 @@ def orbits(phase, cache, kwargs, dim_factor=0.8, margin=70):
     # Initialize new cache
     if cache.get("mode") != "orbits":
         cache = {"mode":"orbits",
-                 "rgb_values": np.zeros(shape),
-                 "pix_1": n_pix / 2
+                 "rgb_values": pattern_buffer(shape),
+                 "pix_1": n_pix / 2,
+                 "color_1_sat": pattern_buffer(3),
+                 "color_2_sat": pattern_buffer(3)
                  }
         color_1_int = random.randint(0, 255)
         color_2_int = random.randint(0, 255)
@@ -218,8 +284,8 @@ def orbits(phase, cache, kwargs, dim_factor=0.8, margin=70):
     color_2 = cache["color_2"]
 
     desaturate = 255 - (saturation * 255.)
-    color_1_sat = np.maximum(color_1, desaturate)
-    color_2_sat = np.maximum(color_2, desaturate)
+    color_1_sat = np.maximum(color_1, desaturate, out=cache["color_1_sat"])
+    color_2_sat = np.maximum(color_2, desaturate, out=cache["color_2_sat"])
 
     # Update if moved to next pix
     curr_pix_1 = int((n_pix * phase) + (n_pix / 2))
@@ -233,26 +299,27 @@ def orbits(phase, cache, kwargs, dim_factor=0.8, margin=70):
         # Update pix_1
         rgb_1 = color_1_sat
         if warm_shift:
-            rgb_1 = shift(rgb_1, warm_rgb, 1. - saturation)
+            rgb_1 = shift(rgb_1, warm_rgb, 1. - saturation, out=rgb_1)
         rgb_values[curr_pix_1] = rgb_1
 
         # Update pix_2
         rgb_2 = color_2_sat
         if warm_shift:
-            rgb_2 = shift(rgb_2, warm_rgb, 1. - saturation)
+            rgb_2 = shift(rgb_2, warm_rgb, 1. - saturation, out=rgb_2)
         rgb_values[curr_pix_2] = rgb_2
 
-        rgb_values = rgb_values * dim_factor
+        rgb_values *= dim_factor
 
     # Save new values in cache
-    cache["rgb_values"] = rgb_values
     cache["pix_1"] = curr_pix_1
     cache["color_1"] = color_1
     cache["color_2"] = color_2
 
-    return rgb_values, cache
+    out = _out_buffer(out, shape)
+    np.copyto(out, rgb_values)
+    return out, cache
 
-def solid(phase, cache, kwargs):
+def solid(phase, cache, kwargs, out=None):
     """Solid color pattern - no animation, just constant color"""
     shape = kwargs["shape"]
     saturation = kwargs["saturation"]
@@ -260,22 +327,20 @@ def solid(phase, cache, kwargs):
     warm_shift = kwargs["warm_shift"]
     warm_rgb = kwargs["warm_rgb"]
     
-    # Create solid color across all pixels
-    from colors import wheel, shift
-    
-    # Use the controller's hue value
-    rgb = wheel(hue, True, saturation)
+    # Fill all pixels with the controller's hue (brightness is applied later by controller)
+    rgb_values = _out_buffer(out, shape)
+    rgb_values[:] = wheel_table(saturation)[int(hue) % 256]
     
+    # Whole numbers, as the frame was once stored as uint8
     if warm_shift:
-        rgb = shift(rgb, warm_rgb, 1.0 - saturation)
-    
-    # Fill all pixels with the same color (brightness is applied later by controller)
-    rgb_values = np.full(shape, rgb, dtype=np.uint8)
+        shift(rgb_values, warm_rgb, 1.0 - saturation, out=rgb_values)
+    else:
+        np.trunc(rgb_values, out=rgb_values)
     
     return rgb_values, cache
 
 
-def sparks(phase, cache, kwargs, active_fraction=0.5, wait_factor=0.4):
+def sparks(phase, cache, kwargs, out=None, active_fraction=0.5, wait_factor=0.4):
 
     shape = kwargs["shape"]
     n_pix = shape[0]
@@ -289,13 +354,15 @@ def sparks(phase, cache, kwargs, active_fraction=0.5, wait_factor=0.4):
     if cache.get("mode") != "sparks":
         cache = {"mode":"sparks",
                  "wait": None,
-                 "wait_start": None}
+                 "wait_start": None,
+                 "rng": np.random.default_rng()}
 
     wait = cache["wait"]
     wait_start = cache["wait_start"]
+    rng = cache["rng"]
 
-    rgb_values = np.zeros(shape)
-    desaturate = 255 - (saturation * 255.)
+    rgb_values = _out_buffer(out, shape)
+    rgb_values.fill(0)
 
     # If in wait mode
     if wait is not None and wait_start is not None:
@@ -306,16 +373,18 @@ def sparks(phase, cache, kwargs, active_fraction=0.5, wait_factor=0.4):
         wait = None
         wait_start = None
 
+    # Light up random pixels (with repeats) in random colors
     n_choices = int(n_pix * active_fraction)
-    for i in range(n_choices):
-        dim = random.random()
-        curr_rgb = wheel(random.randint(0, 255), True, saturation)
-        if warm_shift:
-            curr_rgb = shift(curr_rgb, warm_rgb, 1. - saturation)
-        rgb_values[random.randint(0, n_pix-1)] = curr_rgb
+    pix_idx = rng.integers(0, n_pix, n_choices)
+    wheel_idx = rng.integers(0, 256, n_choices)
+    rgb_values[pix_idx] = wheel_array(wheel_idx, saturation)
+
+    # Warm shift the whole frame in one multiply
+    if warm_shift:
+        shift(rgb_values, warm_rgb, 1. - saturation, out=rgb_values)
 
-    wait_start = time.time()
-    wait = random.random() * wait_factor * 1000
+    wait_start = loop_start
+    wait = rng.random() * wait_factor * 1000
 
     cache["wait"] = wait
     cache["wait_start"] = wait_start
@@ -0,0 +1,54 @@
+""" Contains the LatestFrame class which hands frames from the
+render thread to an output thread, so the next frame can be
+rendered while the current one is still being clocked out """
+
+import threading
+import numpy as np
+
+
+class LatestFrame:
+    """ Two slot frame handoff that always holds the newest frame.
+    A frame the output thread has not taken before the next one is
+    put is dropped rather than queued """
+
+    def __init__(self, shape, dtype=np.uint8):
+        self._pending = np.zeros(shape, dtype=dtype)  # Written by put
+        self._current = np.zeros(shape, dtype=dtype)  # Being read by the output
+        self._fresh = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self.dropped = 0  # Frames overwritten before the output took them
+
+    def put(self, frame):
+        """Copy in a new frame, replacing any the output has not taken yet"""
+        with self._cond:
+            np.copyto(self._pending, frame)
+            if self._fresh:
+                self.dropped += 1
+            self._fresh = True
+            self._cond.notify()
+
+    def take(self, timeout=None):
+        """Wait for a new frame and return it. The frame stays valid until
+        the next take. Returns None on timeout or once closed"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._fresh or self._closed, timeout):
+                return None
+            if not self._fresh:
+                return None
+            self._pending, self._current = self._current, self._pending
+            self._fresh = False
+            return self._current
+
+    def close(self):
+        """Wake the output thread so it can exit"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def reopen(self):
+        """Accept frames again after close, dropping any left over
+        from the last run"""
+        with self._cond:
+            self._closed = False
+            self._fresh = False
@@ -1,17 +1,28 @@
 """ Contains functions which handle the interface to
 the WS2801 LED lights """
 
+import time
 import Adafruit_WS2801
 import Adafruit_GPIO.SPI as SPI
 import numpy as np
 
 BRIGHT_WHITE = Adafruit_WS2801.RGB_to_color(255, 255, 255)
 
-def get_pixels():
-    PIXEL_COUNT = 50
-    SPI_PORT = 0
-    SPI_DEVICE = 0
-    pixels = Adafruit_WS2801.WS2801Pixels(PIXEL_COUNT, spi=SPI.SpiDev(SPI_PORT, SPI_DEVICE))
+# Column order used to lay out each pixel on the wire. WS2801Pixels
+# clocks out r, g, b but some strips are wired with other orders
+CHANNEL_ORDERS = {"rgb": (0, 1, 2),
+                  "rbg": (0, 2, 1),
+                  "grb": (1, 0, 2),
+                  "gbr": (1, 2, 0),
+                  "brg": (2, 0, 1),
+                  "bgr": (2, 1, 0)}
+
+# WS2801 latches data once the clock has been held low for 500us.
+# Same delay as WS2801Pixels.show()
+LATCH_DELAY = 0.002
+
+def get_pixels(count=50, port=0, device=0, spi_factory=SPI.SpiDev):
+    pixels = Adafruit_WS2801.WS2801Pixels(count, spi=spi_factory(port, device))
     return pixels
 
 def turn_off(pixels):
@@ -28,3 +39,40 @@ def get_all_values(pixels):
 def set_all_values(pixels, array):
     for i, (r, g, b) in enumerate(array):
         pixels.set_pixel(i, Adafruit_WS2801.RGB_to_color(int(r), int(g), int(b)))
+
+def frame_to_bytes(array, channel_order="rgb", out=None):
+    """ Converts an (n, 3) frame of rgb values into a contiguous
+    uint8 buffer in wire order. Values are clamped to 0-255 and
+    truncated like int(). Pass out to reuse a buffer between frames """
+    if out is None:
+        out = np.empty((len(array), 3), dtype=np.uint8)
+    np.clip(array, 0, 255, out=out, casting="unsafe")
+    order = CHANNEL_ORDERS[channel_order]
+    if order != (0, 1, 2):
+        out[:] = out[:, order]
+    return out
+
+def write_bytes(spi, buffer):
+    """ Clocks a uint8 buffer out over SPI in a single transfer """
+    device = getattr(spi, "_device", None)
+    if device is not None and hasattr(device, "writebytes2"):
+        # spidev >= 3.4 takes any buffer and splits it into
+        # bufsiz sized chunks itself
+        device.writebytes2(buffer)
+    else:
+        spi.write(buffer.reshape(-1).tolist())
+
+def show_frame(pixels, array, channel_order="rgb", out=None):
+    """ Bulk alternative to set_all_values followed by pixels.show().
+    Skips the per pixel Python calls and the WS2801Pixels buffer,
+    so get_all_values will not reflect frames written this way.
+    Contiguous uint8 rgb frames are written as they are """
+    array = np.asarray(array)
+    if (array.dtype == np.uint8 and array.flags.c_contiguous
+            and CHANNEL_ORDERS[channel_order] == (0, 1, 2)):
+        buffer = array
+    else:
+        buffer = frame_to_bytes(array, channel_order, out)
+    write_bytes(pixels._spi, buffer)
+    time.sleep(LATCH_DELAY)
+    return buffer
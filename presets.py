@@ -1,5 +1,6 @@
 """ Preset management for saving and loading custom light configurations """
 
+import copy
 import json
 import os
 import threading
@@ -13,9 +14,20 @@ class PresetManager:
     
     DEFAULT_PRESETS_DIR = os.path.expanduser("~/.all_of_the_lights/presets")
     
-    def __init__(self, presets_dir=None):
+    def __init__(self, presets_dir=None, rescan_interval=1.0):
+        """
+        Args:
+            presets_dir (str, optional): Directory for preset files
+            rescan_interval (float): Seconds a listing may reuse the index
+                before the directory is checked for added, changed or
+                removed files
+        """
         self.presets_dir = Path(presets_dir) if presets_dir else Path(self.DEFAULT_PRESETS_DIR)
         self._lock = threading.RLock()
+        self.rescan_interval = rescan_interval
+        self._index = {}         # preset_id -> (mtime_ns, size, preset_data, summary)
+        self._last_scan = None   # time.monotonic() of the last directory scan
+        self.files_parsed = 0    # Preset files read from disk
         
         # Ensure presets directory exists
         self.presets_dir.mkdir(parents=True, exist_ok=True)
@@ -111,6 +123,12 @@ class PresetManager:
             
             with open(preset_path, 'w') as f:
                 json.dump(preset_data, f, indent=2)
+            
+            with self._lock:
+                # Index what was written, no need to read it back
+                stat = preset_path.stat()
+                self._index[preset_path.stem] = self._index_entry(
+                    stat, copy.deepcopy(preset_data), preset_path.stem)
             return True
         except Exception as e:
             print(f"Error saving preset file {preset_path}: {e}")
@@ -120,11 +138,64 @@ class PresetManager:
         """Load preset data from file"""
         try:
             with open(preset_path, 'r') as f:
+                self.files_parsed += 1
                 return json.load(f)
         except Exception as e:
             print(f"Error loading preset file {preset_path}: {e}")
             return None
     
+    def _index_entry(self, stat, preset_data, preset_id):
+        summary = {
+            'name': preset_data.get('name', preset_id),
+            'description': preset_data.get('description', ''),
+            'created_at': preset_data.get('created_at'),
+            'updated_at': preset_data.get('updated_at'),
+            'pattern': preset_data.get('config', {}).get('pattern', 'unknown')
+        }
+        return (stat.st_mtime_ns, stat.st_size, preset_data, summary)
+    
+    def _refresh_entry(self, preset_id, stat):
+        """Bring one index entry up to date with a file stat, reading the
+        file only if its mtime or size changed. Callers must hold self._lock"""
+        entry = self._index.get(preset_id)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return entry
+        preset_data = self._load_preset_file(self.presets_dir / f"{preset_id}.json")
+        if not preset_data:
+            self._index.pop(preset_id, None)
+            return None
+        entry = self._index_entry(stat, preset_data, preset_id)
+        self._index[preset_id] = entry
+        return entry
+    
+    def _indexed_preset(self, preset_id):
+        """Index entry for one preset, checked against its file with a stat.
+        Returns None if the preset does not exist or can't be read"""
+        with self._lock:
+            try:
+                stat = (self.presets_dir / f"{preset_id}.json").stat()
+            except FileNotFoundError:
+                self._index.pop(preset_id, None)
+                return None
+            return self._refresh_entry(preset_id, stat)
+    
+    def _scan_presets(self):
+        """Sync the index with the directory, at most every rescan_interval
+        seconds. Callers must hold self._lock"""
+        now = time.monotonic()
+        if self._last_scan is not None and now - self._last_scan < self.rescan_interval:
+            return
+        seen = set()
+        with os.scandir(self.presets_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json') and entry.is_file():
+                    preset_id = entry.name[:-len('.json')]
+                    if self._refresh_entry(preset_id, entry.stat()) is not None:
+                        seen.add(preset_id)
+        for preset_id in set(self._index) - seen:
+            del self._index[preset_id]
+        self._last_scan = now
+    
     def save_preset(self, preset_id, name, description, light_service, metadata=None):
         """Save current light state as a preset
         
@@ -200,21 +271,14 @@ class PresetManager:
         """
         try:
             with self._lock:
-                preset_path = self.presets_dir / f"{preset_id}.json"
-                
-                if not preset_path.exists():
+                entry = self._indexed_preset(preset_id)
+                if entry is None:
                     return {
                         'success': False,
                         'message': f'Preset "{preset_id}" not found'
                     }
                 
-                preset_data = self._load_preset_file(preset_path)
-                if not preset_data:
-                    return {
-                        'success': False,
-                        'message': f'Failed to load preset "{preset_id}"'
-                    }
-                
+                preset_data = copy.deepcopy(entry[2])
                 config = preset_data.get('config', {})
                 
                 # Apply configuration to light service
@@ -278,26 +342,18 @@ class PresetManager:
             dict: Preset data or error result
         """
         try:
-            preset_path = self.presets_dir / f"{preset_id}.json"
-            
-            if not preset_path.exists():
+            entry = self._indexed_preset(preset_id)
+            if entry is None:
                 return {
                     'success': False,
                     'message': f'Preset "{preset_id}" not found'
                 }
             
-            preset_data = self._load_preset_file(preset_path)
-            if preset_data:
-                return {
-                    'success': True,
-                    'preset_id': preset_id,
-                    'preset_data': preset_data
-                }
-            else:
-                return {
-                    'success': False,
-                    'message': f'Failed to load preset "{preset_id}"'
-                }
+            return {
+                'success': True,
+                'preset_id': preset_id,
+                'preset_data': copy.deepcopy(entry[2])
+            }
                 
         except Exception as e:
             return {
@@ -305,34 +361,35 @@ class PresetManager:
                 'message': f'Error getting preset: {e}'
             }
     
-    def list_presets(self):
-        """List all available presets
+    def list_presets(self, offset=0, limit=None, pattern=None):
+        """List available presets from the in-memory index, sorted by id
         
+        Args:
+            offset (int): Number of matching presets to skip
+            limit (int, optional): Most presets to return, all if None
+            pattern (str, optional): Only list presets using this pattern
+            
         Returns:
-            dict: List of all presets with their metadata
+            dict: Summaries of the presets on this page, the number on the
+                page and the total number matching
         """
         try:
             with self._lock:
-                presets = {}
+                self._scan_presets()
                 
-                for preset_file in self.presets_dir.glob("*.json"):
-                    preset_id = preset_file.stem
-                    preset_data = self._load_preset_file(preset_file)
-                    
-                    if preset_data:
-                        # Return summary info, not full config
-                        presets[preset_id] = {
-                            'name': preset_data.get('name', preset_id),
-                            'description': preset_data.get('description', ''),
-                            'created_at': preset_data.get('created_at'),
-                            'updated_at': preset_data.get('updated_at'),
-                            'pattern': preset_data.get('config', {}).get('pattern', 'unknown')
-                        }
+                matching = [(preset_id, entry[3]) for preset_id, entry in sorted(self._index.items())
+                            if pattern is None or entry[3]['pattern'] == pattern]
+                page = matching[offset:offset + limit if limit is not None else None]
+                
+                # Summaries are shared with the index, copy them for the caller
+                presets = {preset_id: dict(summary) for preset_id, summary in page}
                 
                 return {
                     'success': True,
                     'presets': presets,
-                    'count': len(presets)
+                    'count': len(presets),
+                    'total': len(matching),
+                    'offset': offset
                 }
                 
         except Exception as e:
@@ -361,11 +418,12 @@ class PresetManager:
                     }
                 
                 # Get preset name for the response
-                preset_data = self._load_preset_file(preset_path)
-                preset_name = preset_data.get('name', preset_id) if preset_data else preset_id
+                entry = self._indexed_preset(preset_id)
+                preset_name = entry[3]['name'] if entry else preset_id
                 
                 # Delete the file
                 preset_path.unlink()
+                self._index.pop(preset_id, None)
                 
                 return {
                     'success': True,
@@ -403,12 +461,13 @@ class PresetManager:
                     }
                 
                 # Load existing preset
-                preset_data = self._load_preset_file(preset_path)
-                if not preset_data:
+                entry = self._indexed_preset(preset_id)
+                if entry is None:
                     return {
                         'success': False,
                         'message': f'Failed to load preset "{preset_id}" for updating'
                     }
+                preset_data = copy.deepcopy(entry[2])
                 
                 # Update fields
                 if name is not None:
@@ -0,0 +1,49 @@
+""" Profiling helpers for a single running thread, used to look
+at the render loop of a live controller without restarting it.
+Nothing here runs unless a profile has been asked for, and
+cProfile and pstats are only imported then """
+
+import io
+import sys
+import time
+from collections import Counter
+
+MODES = ('cprofile', 'sample')
+
+
+def start_cprofile():
+    """Start a deterministic profile of the calling thread"""
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def cprofile_report(profiler, limit=40):
+    """Stop profiler and return its top functions by cumulative time as pstats text"""
+    import pstats
+    profiler.disable()
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
+
+
+def sample_thread(thread_id, seconds, interval=0.005):
+    """Sample the stack of the thread with ident thread_id every interval
+    seconds for seconds. Returns collapsed stacks ("outer;inner count"
+    per line, most frequent first), the input format of flamegraph.pl"""
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            break  # Thread has exited
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stacks[';'.join(reversed(names))] += 1
+        time.sleep(interval)
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
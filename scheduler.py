@@ -0,0 +1,73 @@
+""" Contains the FrameScheduler class which paces the render
+loop against absolute deadlines on the monotonic clock, so the
+frame rate does not drift with the cost of each frame """
+
+import time
+from collections import deque
+
+
+class FrameScheduler:
+    """ Sleeps until the next frame deadline and keeps timing stats """
+
+    def __init__(self, target_fps=60, clock=time.monotonic, sleep=time.sleep, window=120):
+        self.clock = clock
+        self.sleep = sleep
+        self.set_target_fps(target_fps)
+        self.frames_dropped = 0  # Deadlines skipped because a frame ran late
+        self._frame_times = deque(maxlen=window)
+        self._next_deadline = None
+
+    def set_target_fps(self, target_fps):
+        """Set the target frame rate (1 to 240 fps)"""
+        self.target_fps = max(1, min(240, float(target_fps)))
+        self.period = 1.0 / self.target_fps
+        return self.target_fps
+
+    def reset(self):
+        """Start a fresh run of deadlines, e.g. after the loop has idled"""
+        self._next_deadline = None
+        self._frame_times.clear()
+
+    def wait(self):
+        """Sleep until the next deadline and return the time it was reached.
+        Deadlines that have already been missed by a whole period are
+        dropped rather than rendered back to back to catch up"""
+        now = self.clock()
+        if self._next_deadline is None:
+            self._next_deadline = now
+        else:
+            delay = self._next_deadline - now
+            if delay > 0:
+                self.sleep(delay)
+                now = self.clock()
+
+            late = now - self._next_deadline
+            if late >= self.period:
+                missed = int(late // self.period)
+                self.frames_dropped += missed
+                self._next_deadline += missed * self.period
+
+        self._next_deadline += self.period
+        self._frame_times.append(now)
+        return now
+
+    def get_stats(self):
+        """Get achieved frame rate and jitter over the recent window"""
+        times = list(self._frame_times)
+        if len(times) < 2:
+            return {
+                'target_fps': self.target_fps,
+                'achieved_fps': 0.0,
+                'jitter_ms': 0.0,
+                'frames_dropped': self.frames_dropped
+            }
+
+        intervals = [b - a for a, b in zip(times, times[1:])]
+        mean = sum(intervals) / len(intervals)
+        variance = sum((i - mean) ** 2 for i in intervals) / len(intervals)
+        return {
+            'target_fps': self.target_fps,
+            'achieved_fps': round(1.0 / mean, 2) if mean > 0 else 0.0,
+            'jitter_ms': round(variance ** 0.5 * 1000, 3),
+            'frames_dropped': self.frames_dropped
+        }
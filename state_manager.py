@@ -12,60 +12,201 @@ class StateManager:
     
     DEFAULT_STATE_DIR = os.path.expanduser("~/.all_of_the_lights")
     DEFAULT_STATE_FILE = "controller_state.json"
+    DEFAULT_COMPACT_BYTES = 64 * 1024
     
-    def __init__(self, state_dir=None, state_file=None):
+    def __init__(self, state_dir=None, state_file=None, journal=False, compact_bytes=None):
+        """
+        Args:
+            state_dir (str, optional): Directory for state files
+            state_file (str, optional): Snapshot file name
+            journal (bool): Append each changed setting to a journal instead of
+                rewriting the snapshot on every save
+            compact_bytes (int, optional): Journal size that triggers folding it
+                into the snapshot
+        """
         self.state_dir = Path(state_dir) if state_dir else Path(self.DEFAULT_STATE_DIR)
         self.state_file = state_file or self.DEFAULT_STATE_FILE
         self.state_path = self.state_dir / self.state_file
+        self.journal = journal
+        self.journal_path = self.state_path.with_suffix('.journal')
+        self.compact_bytes = compact_bytes or self.DEFAULT_COMPACT_BYTES
         self._lock = threading.RLock()
+        self._journaled = None   # State the snapshot plus journal add up to, once loaded
+        self._compacting = False
+        self.writes = 0          # State files written or journal appends
+        self.bytes_written = 0   # Bytes written to state files
+        self.compactions = 0     # Journals folded into the snapshot
         
         # Ensure state directory exists
         self.state_dir.mkdir(parents=True, exist_ok=True)
     
-    def save_state(self, controller_status, metadata=None):
+    def save_state(self, controller_status, metadata=None, snapshot=False):
         """Save controller state to file
         
         Args:
             controller_status (dict): Status from controller.get_status()
             metadata (dict, optional): Additional metadata to save
+            snapshot (bool): Write the full state file even in journal mode,
+                where unchanged settings would otherwise write nothing
             
         Returns:
             bool: True if saved successfully, False otherwise
         """
         try:
             with self._lock:
-                state_data = {
-                    'timestamp': time.time(),
-                    'controller_state': controller_status,
-                    'metadata': metadata or {}
-                }
-                
-                # Write to temporary file first, then rename for atomic operation
-                temp_path = self.state_path.with_suffix('.tmp')
-                with open(temp_path, 'w') as f:
-                    json.dump(state_data, f, indent=2)
-                
-                # Atomic rename
-                temp_path.rename(self.state_path)
+                if self.journal and not snapshot:
+                    return self._append_changes(controller_status, metadata)
+                self._write_snapshot(controller_status, metadata)
+                if self.journal:
+                    # The snapshot replaced the journal, carry on diffing from it
+                    self._journaled = {'timestamp': time.time(),
+                                       'controller_state': dict(controller_status),
+                                       'metadata': metadata or {}}
                 return True
                 
         except Exception as e:
             print(f"Error saving state: {e}")
             return False
     
+    def _write_snapshot(self, controller_status, metadata):
+        state_data = {
+            'timestamp': time.time(),
+            'controller_state': controller_status,
+            'metadata': metadata or {}
+        }
+        
+        data = json.dumps(state_data, separators=(',', ':'))
+        
+        # Write to temporary file first, then rename for atomic operation.
+        # fsync before the rename so a crash can't leave an empty file
+        temp_path = self.state_path.with_suffix('.tmp')
+        with open(temp_path, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        
+        # Atomic rename, then sync the directory so the rename is durable
+        temp_path.rename(self.state_path)
+        self._fsync_dir()
+        
+        # The snapshot holds the whole state now, so an older journal
+        # (e.g. left by a run with journal=True) must not be replayed over it
+        if self.journal_path.exists():
+            self.journal_path.unlink()
+            self._fsync_dir()
+        
+        self.writes += 1
+        self.bytes_written += len(data)
+        return True
+    
+    def _append_changes(self, controller_status, metadata):
+        """Append a record for each setting that differs from the journaled state"""
+        if self._journaled is None:
+            self._journaled = self.load_state() or {'controller_state': {}, 'metadata': {}}
+        state = self._journaled['controller_state']
+        
+        now = time.time()
+        records = [{'p': name, 'v': value, 't': now}
+                   for name, value in controller_status.items()
+                   if name not in state or state[name] != value]
+        if not records:
+            return True
+        
+        data = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+        with open(self.journal_path, 'a') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            journal_size = f.tell()
+        
+        state.update(controller_status)
+        self._journaled['timestamp'] = now
+        self._journaled['metadata'] = metadata or {}
+        self.writes += 1
+        self.bytes_written += len(data)
+        
+        if journal_size >= self.compact_bytes and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self.compact, daemon=True).start()
+        return True
+    
+    def compact(self):
+        """Fold the journal into the snapshot and start a new journal
+        
+        Returns:
+            bool: True if compacted successfully, False otherwise
+        """
+        try:
+            with self._lock:
+                if self._journaled is None:
+                    self._journaled = self.load_state()
+                if self._journaled:
+                    # Removes the journal once the snapshot is durable
+                    self._write_snapshot(self._journaled['controller_state'],
+                                         self._journaled.get('metadata'))
+                elif self.journal_path.exists():
+                    self.journal_path.unlink()
+                    self._fsync_dir()
+                self.compactions += 1
+                return True
+        except Exception as e:
+            print(f"Error compacting state journal: {e}")
+            return False
+        finally:
+            self._compacting = False
+    
+    def _fsync_dir(self):
+        """Flush the state directory entry to disk"""
+        fd = os.open(self.state_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    
+    def get_stats(self):
+        """Get write counters
+        
+        Returns:
+            dict: Number of state writes, bytes written and journal compactions
+        """
+        stats = {'writes': self.writes, 'bytes_written': self.bytes_written}
+        if self.journal:
+            stats['compactions'] = self.compactions
+            stats['journal_bytes'] = self.journal_path.stat().st_size if self.journal_path.exists() else 0
+        return stats
+    
     def load_state(self):
-        """Load controller state from file
+        """Load controller state from file, replaying the journal on top of
+        the snapshot if there is one
         
         Returns:
             dict or None: State data if loaded successfully, None otherwise
         """
         try:
             with self._lock:
-                if not self.state_path.exists():
-                    return None
+                state_data = None
+                if self.state_path.exists():
+                    with open(self.state_path, 'r') as f:
+                        state_data = json.load(f)
                 
-                with open(self.state_path, 'r') as f:
-                    state_data = json.load(f)
+                if self.journal_path.exists():
+                    state_data = state_data or {'controller_state': {}, 'metadata': {}}
+                    with open(self.journal_path, 'r+b') as f:
+                        good_bytes = 0
+                        for line in f:
+                            try:
+                                # A record only counts once its newline is written
+                                if not line.endswith(b'\n'):
+                                    raise ValueError('unterminated record')
+                                record = json.loads(line)
+                            except ValueError:
+                                # Torn final append from a crash. Cut it off so
+                                # the next append starts on a clean line
+                                f.truncate(good_bytes)
+                                break
+                            good_bytes += len(line)
+                            state_data['controller_state'][record['p']] = record['v']
+                            state_data['timestamp'] = record['t']
                 
                 return state_data
                 
@@ -90,7 +231,7 @@ class StateManager:
         Returns:
             bool: True if state file exists
         """
-        return self.state_path.exists()
+        return self.state_path.exists() or self.journal_path.exists()
     
     def delete_state(self):
         """Delete the state file
@@ -99,8 +240,12 @@ class StateManager:
             bool: True if deleted successfully or file didn't exist
         """
         try:
-            if self.state_path.exists():
-                self.state_path.unlink()
+            with self._lock:
+                if self.state_path.exists():
+                    self.state_path.unlink()
+                if self.journal_path.exists():
+                    self.journal_path.unlink()
+                self._journaled = None
             return True
         except Exception as e:
             print(f"Error deleting state: {e}")
@@ -127,7 +272,8 @@ class StateManager:
         }
     
     def apply_state_to_service(self, light_service, state=None):
-        """Apply saved state to a light service
+        """Apply saved state to a light service in one step. Before the
+        service is initialized this sets what the first frame shows
         
         Args:
             light_service: APILightService instance
@@ -143,67 +289,35 @@ class StateManager:
             # Use default state if no saved state found
             state = self.create_default_state()
         
-        results = []
-        
         try:
-            # Apply each setting
-            if 'pattern' in state:
-                result = light_service.set_pattern(state['pattern'])
-                results.append(('pattern', result))
-            
-            if 'brightness' in state:
-                result = light_service.set_brightness(state['brightness'])
-                results.append(('brightness', result))
-            
-            if 'saturation' in state:
-                result = light_service.set_saturation(state['saturation'])
-                results.append(('saturation', result))
-            
-            if 'speed_factor' in state:
-                result = light_service.set_speed(state['speed_factor'])
-                results.append(('speed_factor', result))
-            
-            if 'tempo' in state:
-                result = light_service.set_tempo(state['tempo'])
-                results.append(('tempo', result))
-            
-            if 'alt_mode' in state:
-                # Only toggle if current state differs from desired state
-                current_status = light_service.get_status()
-                if current_status.get('alt_mode') != state['alt_mode']:
-                    result = light_service.toggle_alt_mode()
-                    results.append(('alt_mode', result))
-            
-            if 'mute' in state and 'mute_type' in state:
-                result = light_service.set_mute(state['mute'], state['mute_type'])
-                results.append(('mute', result))
-            
-            # Count successful applications
-            successful = sum(1 for _, result in results if result.get('success', False))
-            total = len(results)
-            
+            # One snapshot, so nothing renders with half the settings applied
+            result = light_service.restore_state(state)
             return {
-                'success': successful > 0,
-                'message': f'Applied {successful}/{total} state settings',
-                'results': results,
+                'success': result['success'],
+                'message': f"Applied {len(result['restored'])} state settings",
+                'restored': result['restored'],
                 'state_applied': state
             }
             
         except Exception as e:
             return {
                 'success': False,
-                'message': f'Error applying state: {e}',
-                'results': results
+                'message': f'Error applying state: {e}'
             }
 
 
 class AutoStateManager:
-    """ Automatically saves state at regular intervals """
+    """ Saves state whenever the controller settings change. Bursts of
+    changes are coalesced into one write and nothing is written while
+    the settings stay the same """
     
-    def __init__(self, light_service, state_manager=None, save_interval=30):
+    def __init__(self, light_service, state_manager=None, debounce_ms=500, max_delay_ms=5000):
         self.light_service = light_service
         self.state_manager = state_manager or StateManager()
-        self.save_interval = save_interval  # seconds
+        self.debounce = debounce_ms / 1000.0    # Quiet time after a change before saving
+        self.max_delay = max_delay_ms / 1000.0  # Save anyway if changes never stop for this long
+        self.saved_version = None  # Settings version in the state file
+        self._saved_status = None  # Status last written
         self._running = False
         self._thread = None
         self._lock = threading.Lock()
@@ -215,6 +329,9 @@ class AutoStateManager:
                 return False
             
             self._running = True
+            # Whatever is running now came from the state file (or defaults)
+            self.saved_version = self.light_service.wait_for_change(None, 0)
+            self._saved_status = None
             self._thread = threading.Thread(target=self._save_loop, daemon=True)
             self._thread.start()
             return True
@@ -231,26 +348,53 @@ class AutoStateManager:
         """Main loop for automatic state saving"""
         while self._running:
             try:
-                # Get current status and save it
-                status = self.light_service.get_status()
-                if status.get('service_running', False):
-                    self.state_manager.save_state(status, {'auto_saved': True})
+                # Sleep until the settings change, checking now and then for stop()
+                version = self.light_service.wait_for_change(self.saved_version, timeout=1.0)
+                if version == self.saved_version:
+                    continue
                 
-                # Wait for next save interval
-                for _ in range(int(self.save_interval)):
-                    if not self._running:
+                # Debounce: wait for the burst of changes to settle
+                first_change = time.monotonic()
+                while self._running:
+                    remaining = self.max_delay - (time.monotonic() - first_change)
+                    if remaining <= 0:
+                        break
+                    latest = self.light_service.wait_for_change(version, timeout=min(self.debounce, remaining))
+                    if latest == version:
                         break
-                    time.sleep(1)
+                    version = latest
+                
+                self._save(version, {'auto_saved': True})
                     
             except Exception as e:
                 print(f"Error in auto-save loop: {e}")
                 time.sleep(5)  # Wait a bit before retrying
     
+    def _save(self, version, metadata, force=False):
+        # Save where transitions are heading, so a fade is saved once, with
+        # its target, and a restart mid fade lands on the target
+        status = self.light_service.get_status(targets=True)
+        if 'pattern' not in status:
+            return False  # Service never started, no settings to save
+        if not force and not status.get('service_running', False):
+            return False
+        if not force and status == self._saved_status:
+            # e.g. the version bump when a transition finishes
+            self.saved_version = version
+            return True
+        # A forced save writes the full state file even in journal mode
+        if self.state_manager.save_state(status, metadata, snapshot=force):
+            self.saved_version = version
+            self._saved_status = status
+            return True
+        return False
+    
     def force_save(self):
-        """Force an immediate save"""
+        """Force an immediate save of the full state, even if nothing changed
+        since the last one (the state file may have been deleted or reset)"""
         try:
-            status = self.light_service.get_status()
-            return self.state_manager.save_state(status, {'manual_save': True})
+            version = self.light_service.wait_for_change(None, 0)
+            return self._save(version, {'manual_save': True}, force=True)
         except Exception as e:
             print(f"Error in force save: {e}")
-            return False
\ No newline at end of file
+            return False
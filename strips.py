@@ -0,0 +1,105 @@
+""" Contains the MultiStrip class which drives several WS2801
+strips, each on its own SPI bus or chip select, as one logical
+run of pixels. Each strip shows its slice of the frame on its
+own thread so the transfers happen in parallel """
+
+import json
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import Adafruit_WS2801
+import Adafruit_GPIO.SPI as SPI
+import pixels as px
+from metrics import Histogram
+
+# One physical strip. offset is where its first pixel sits in the logical frame
+StripConfig = namedtuple('StripConfig', ['port', 'device', 'length', 'offset', 'channel_order'])
+StripConfig.__new__.__defaults__ = (0, 'rgb')
+
+
+def load_strip_config(path):
+    """Read strip configs from a JSON list of objects with port, device,
+    length and optionally offset and channel_order. Strips without an
+    offset follow on from the previous strip"""
+    with open(path, 'r') as f:
+        entries = json.load(f)
+
+    configs = []
+    next_offset = 0
+    for i, entry in enumerate(entries):
+        offset = entry.get('offset', next_offset)
+        config = StripConfig(port=int(entry['port']),
+                             device=int(entry['device']),
+                             length=int(entry['length']),
+                             offset=int(offset),
+                             channel_order=entry.get('channel_order', 'rgb'))
+        # Catch config mistakes at startup rather than on the first frame
+        if config.length <= 0:
+            raise ValueError(f"strip {i} in {path}: length must be positive, got {config.length}")
+        if config.offset < 0:
+            raise ValueError(f"strip {i} in {path}: offset must not be negative, got {config.offset}")
+        if config.channel_order not in px.CHANNEL_ORDERS:
+            raise ValueError(f"strip {i} in {path}: unknown channel_order '{config.channel_order}', "
+                             f"expected one of {sorted(px.CHANNEL_ORDERS)}")
+        configs.append(config)
+        next_offset = config.offset + config.length
+    if not configs:
+        raise ValueError(f"{path} lists no strips")
+    return configs
+
+
+class MultiStrip:
+    """ Several strips addressed as one frame of count() pixels """
+
+    def __init__(self, configs, spi_factory=SPI.SpiDev):
+        """spi_factory(port, device) opens the SPI device for a strip.
+        Pass a fake to run without hardware"""
+        self.configs = list(configs)
+        self.strips = [Adafruit_WS2801.WS2801Pixels(config.length,
+                                                    spi=spi_factory(config.port, config.device))
+                       for config in self.configs]
+        self.names = [f"spi{config.port}.{config.device}" for config in self.configs]
+        self._buffers = [np.empty((config.length, 3), dtype=np.uint8) for config in self.configs]
+        self.timings = {name: Histogram() for name in self.names}  # Seconds per write
+        self._executor = ThreadPoolExecutor(max_workers=len(self.configs),
+                                            thread_name_prefix='strip') if len(self.configs) > 1 else None
+
+    def count(self):
+        return max(config.offset + config.length for config in self.configs)
+
+    def _write(self, i, frame):
+        config = self.configs[i]
+        start = time.perf_counter()
+        section = frame[config.offset:config.offset + config.length]
+        if config.channel_order != 'rgb' or section.dtype != np.uint8:
+            section = px.frame_to_bytes(section, config.channel_order, self._buffers[i])
+        px.write_bytes(self.strips[i]._spi, section)
+        self.timings[self.names[i]].observe(time.perf_counter() - start)
+
+    def write(self, frame):
+        """Write each strip's slice of frame, in parallel when there are several"""
+        if self._executor is None:
+            self._write(0, frame)
+            return
+        futures = [self._executor.submit(self._write, i, frame) for i in range(len(self.configs))]
+        for future in futures:
+            future.result()
+
+    def get_stats(self):
+        """Get write count and mean write time per strip"""
+        return {name: {'writes': histogram.count,
+                       'mean_ms': round(histogram.sum / histogram.count * 1000, 3) if histogram.count else 0.0}
+                for name, histogram in self.timings.items()}
+
+
+def show_frame(strips, array):
+    """ show_frame for a MultiStrip, all strips latch together """
+    strips.write(np.asarray(array))
+    time.sleep(px.LATCH_DELAY)
+
+
+def turn_off(strips):
+    for strip in strips.strips:
+        strip.clear()
+        strip.show()